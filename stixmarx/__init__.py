@@ -19,16 +19,49 @@ log.addHandler(ch)
 log.propagate = False
 
 
-def parse(xml_input, encoding=None):
+def parse(xml_input, encoding=None, lazy=False, interning=None):
     from stixmarx import parser
     from stixmarx import container
 
-    stix_package = parser.parse_xml(xml_input, encoding)
-    marking_container = container.MarkingContainer(stix_package)
+    if not lazy:
+        stix_package = parser.parse_xml(xml_input, encoding, interning)
+        return container.MarkingContainer(stix_package)
+
+    marking_parser = parser.MarkingParser(
+        xml_input,
+        encoding,
+        lazy=True,
+        interning=interning
+    )
+    stix_package = marking_parser.parse()
+    marking_container = container.MarkingContainer(
+        stix_package,
+        resolver=marking_parser
+    )
 
     return marking_container
 
 
+def iterparse(xml_input, encoding=None):
+    from stixmarx import parser
+
+    return parser.iterparse_xml(xml_input, encoding)
+
+
+def parse_many(sources, workers=None, encoding=None, ordered=True,
+               reducer=None, chunksize=1):
+    from stixmarx import bulk
+
+    return bulk.parse_many(
+        sources,
+        workers=workers,
+        encoding=encoding,
+        ordered=ordered,
+        reducer=reducer,
+        chunksize=chunksize
+    )
+
+
 def new():
     from stixmarx import container
     from stix.core import STIXPackage
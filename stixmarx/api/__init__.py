@@ -91,7 +91,7 @@ def contains_marking(markable, marking):
         markable: A marked object.
         marking: A MarkingSpecification object.
     """
-    markings = get_markings(markable)
+    markings = getattr(markable, _ATTR_DATA_MARKINGS, None)
 
     if not markings:
         return False
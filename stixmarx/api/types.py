@@ -80,6 +80,10 @@ class MarkableDateTime(datetime.datetime):
             tzinfo=dt.tzinfo
         )
 
+    def __reduce_ex__(self, protocol):
+        # datetime pickles its own state only; keep __datamarkings__.
+        return (type(self), (self.isoformat(),), self.__dict__)
+
 
 class MarkableDate(datetime.date):
     def __init__(self, value):
@@ -96,6 +100,10 @@ class MarkableDate(datetime.date):
             day=dt.day
         )
 
+    def __reduce_ex__(self, protocol):
+        # datetime pickles its own state only; keep __datamarkings__.
+        return (type(self), (self.isoformat(),), self.__dict__)
+
 
 class MarkableBytes(binary_type):
     def __init__(self, value):
@@ -0,0 +1,167 @@
+# Copyright (c) 2017, The MITRE Corporation. All rights reserved.
+# See LICENSE.txt for complete terms.
+
+"""
+Parse many STIX documents across a pool of worker processes.
+
+Parsed MarkingContainers are sent back to the calling process with pickle.
+mixbox Entities store their field values in a dictionary keyed by the
+TypedField descriptors of their class, so those descriptors are pickled by
+reference (class and attribute name) and the parent process maps them back
+onto its own class attributes. Everything else, including the
+``__datamarkings__`` sets on entities and markable field values, is pickled
+as is.
+"""
+
+# stdlib
+import functools
+import importlib
+import logging
+import multiprocessing
+import pickle
+
+# external
+from mixbox import entities
+from mixbox import fields as mixbox_fields
+from mixbox.vendor.six import BytesIO
+
+# Module-level logger
+LOG = logging.getLogger(__name__)
+
+
+class _Pickler(pickle.Pickler):
+    """Pickles mixbox TypedField descriptors by reference.
+
+    The TypedFields of each Entity class are registered when the first
+    instance of that class is pickled, which always happens before its
+    field dictionary (and the TypedField keys in it) is pickled.
+    """
+
+    def __init__(self, *args, **kwargs):
+        pickle.Pickler.__init__(self, *args, **kwargs)
+        self._klasses = set()
+        self._typedfields = {}
+
+    def _register(self, klass):
+        self._klasses.add(klass)
+
+        for attr, field in klass.typed_fields_with_attrnames():
+            self._typedfields[id(field)] = (klass.__module__, klass.__name__, attr)
+
+    def persistent_id(self, obj):
+        if isinstance(obj, mixbox_fields.TypedField):
+            return self._typedfields.get(id(obj))
+
+        if isinstance(obj, entities.Entity):
+            klass = type(obj)
+
+            if klass not in self._klasses:
+                self._register(klass)
+
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    """Resolves the TypedField references written by _Pickler."""
+
+    def persistent_load(self, pid):
+        module, name, attr = pid
+        klass = getattr(importlib.import_module(module), name)
+        return getattr(klass, attr)
+
+
+def dumps(obj):
+    """Pickle `obj`, which may contain mixbox Entities and marked values.
+
+    Args:
+        obj: An object to pickle (e.g., a MarkingContainer).
+
+    Returns:
+        The pickled `obj` bytes.
+    """
+    buf = BytesIO()
+    _Pickler(buf, pickle.HIGHEST_PROTOCOL).dump(obj)
+    return buf.getvalue()
+
+
+def loads(data):
+    """Unpickle an object pickled with dumps().
+
+    Args:
+        data: The bytes returned by dumps().
+
+    Returns:
+        The unpickled object.
+    """
+    return _Unpickler(BytesIO(data)).load()
+
+
+def _init_worker():
+    """Load python-stix and the stixmarx field mappings once per worker
+    process.
+    """
+    from stixmarx import parser  # noqa
+
+
+def _parse_one(source, encoding=None, reducer=None):
+    """Parse a single document in a worker process.
+
+    Returns:
+        The `reducer` result if `reducer` is given. Otherwise, the pickled
+        MarkingContainer bytes.
+    """
+    import stixmarx
+
+    marking_container = stixmarx.parse(source, encoding)
+
+    if reducer is not None:
+        return reducer(marking_container)
+
+    return dumps(marking_container)
+
+
+def parse_many(sources, workers=None, encoding=None, ordered=True,
+               reducer=None, chunksize=1):
+    """Parse each document in `sources` in a pool of worker processes.
+
+    Note:
+        `sources` must be picklable (e.g., file paths). File-like objects
+        and lxml trees cannot be sent to worker processes. `reducer` must
+        be a module-level function and its return value must be picklable.
+
+    Args:
+        sources: An iterable of STIX documents to parse.
+        workers: The number of worker processes. Defaults to the number of
+            CPUs.
+        encoding: The encoding of the input documents.
+        ordered: If True, results are yielded in the order of `sources`.
+            Otherwise, they are yielded as each document is parsed.
+        reducer: A function which is called in the worker process with each
+            parsed MarkingContainer. Its return value is yielded instead of
+            the MarkingContainer.
+        chunksize: The number of documents sent to a worker process at a
+            time.
+
+    Yields:
+        A MarkingContainer (or the `reducer` result) for each document.
+
+    Raises:
+        Any exception raised while parsing a document is raised by the
+        generator when that document's result is reached.
+    """
+    func = functools.partial(_parse_one, encoding=encoding, reducer=reducer)
+    pool = multiprocessing.Pool(processes=workers, initializer=_init_worker)
+
+    try:
+        if ordered:
+            results = pool.imap(func, sources, chunksize)
+        else:
+            results = pool.imap_unordered(func, sources, chunksize)
+
+        for result in results:
+            if reducer is None:
+                result = loads(result)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
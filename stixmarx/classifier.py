@@ -0,0 +1,310 @@
+# Copyright (c) 2017, The MITRE Corporation. All rights reserved.
+# See LICENSE.txt for complete terms.
+
+"""
+Classifies Controlled_Structure XPath expressions before evaluation.
+
+Nearly every Controlled_Structure (and every one written by
+MarkingSerializer) is a union of a few simple paths: the global selectors,
+a relative location path followed by ``self::node()``,
+``descendant-or-self::node()`` (optionally with ``/@*``), an attribute or
+``text()``. classify() parses such expressions into Path tuples, which can
+be resolved by walking the document tree. Anything else is left to lxml.
+"""
+
+# stdlib
+import collections
+import re
+
+# external
+from lxml import etree
+
+# internal
+from stixmarx import xml
+
+# Expression shapes, as counted by markingmap.build().
+SHAPE_GLOBAL = "global"
+SHAPE_SUBTREE = "subtree"
+SHAPE_NODE = "node"
+SHAPE_FIELD = "field"
+SHAPE_XPATH = "xpath"
+
+# What a Path selects from the elements its location path resolves to.
+TARGET_GLOBAL = "global"                # //node()
+TARGET_GLOBAL_ATTRS = "global-attrs"    # //@*
+TARGET_SUBTREE = "subtree"              # descendant-or-self::node()
+TARGET_SUBTREE_ATTRS = "subtree-attrs"  # descendant-or-self::node()/@*
+TARGET_SELF = "self"                    # the elements themselves
+TARGET_ATTRIBUTE = "attribute"          # @name
+TARGET_ALL_ATTRS = "all-attrs"          # @*
+TARGET_TEXT = "text"                    # text()
+
+# Location steps.
+STEP_PARENT = "parent"
+STEP_CHILD = "child"
+
+_SELF_STEPS = (".", xml.XPATH_AXIS_SELF_NODE)
+_PARENT_STEP = ".."
+_ATTR_PREFIX = "@"
+
+_STEP_SUBTREE = xml.XPATH_SELECT_OPERATOR + xml.XPATH_AXIS_DESCENDANT_OR_SELF_NODE
+_STEP_SUBTREE_ATTRS = _STEP_SUBTREE + xml.XPATH_SELECT_OPERATOR + xml.XPATH_WILDCARD_ALL_ATTRS
+
+_NAME = r"[A-Za-z_][\w.\-]*"
+_RE_QNAME = re.compile(r"^(?:(%s):)?(%s)$" % (_NAME, _NAME))
+_RE_CHILD = re.compile(r"^(?:(%s):)?(%s)(?:\[(\d+)\])?$" % (_NAME, _NAME))
+
+# A parsed union member.
+#
+# start: An XPath which selects the elements to start from, or None to start
+#     from the Controlled_Structure element and follow `steps`.
+# steps: A tuple of location steps, or None if `start` is set. A step is
+#     either ``(STEP_PARENT,)`` or ``(STEP_CHILD, prefix, localname,
+#     position)``, where `position` is a 1-based int or None.
+# target: One of the TARGET_* values.
+# name: A ``(prefix, localname)`` tuple for TARGET_ATTRIBUTE, else None.
+Path = collections.namedtuple("Path", ["start", "steps", "target", "name"])
+
+
+def split_union(xpath):
+    """Split the XPath union expression `xpath` into the stripped paths it
+    joins.
+
+    Union operators inside predicates or string literals are not split on.
+
+    Returns:
+        A list of XPath strings.
+    """
+    if not xpath:
+        return []
+
+    paths = []
+    depth = 0
+    quote = None
+    start = 0
+
+    for idx, char in enumerate(xpath):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char in ("[", "("):
+            depth += 1
+        elif char in ("]", ")"):
+            depth -= 1
+        elif char == "|" and depth == 0:
+            paths.append(xpath[start:idx].strip())
+            start = idx + 1
+
+    paths.append(xpath[start:].strip())
+    return paths
+
+
+def _parse_steps(steps):
+    """Parse the list of location step strings `steps`.
+
+    Returns:
+        A tuple of steps, or None if a step is not a parent step, a self
+        step or a (positional) child element step.
+    """
+    parsed = []
+
+    for step in steps:
+        if step == _PARENT_STEP:
+            parsed.append((STEP_PARENT,))
+            continue
+
+        if step in _SELF_STEPS:
+            continue
+
+        match = _RE_CHILD.match(step)
+
+        if match is None:
+            return None
+
+        prefix, localname, position = match.groups()
+        position = int(position) if position else None
+        parsed.append((STEP_CHILD, prefix, localname, position))
+
+    return tuple(parsed)
+
+
+def _parse_path(path):
+    """Parse a single (non-union) XPath `path`.
+
+    Returns:
+        A Path tuple or None if `path` does not fit a known shape.
+    """
+    if path == xml.XPATH_GLOBAL_ALL_ELEMS:
+        return Path(None, (), TARGET_GLOBAL, None)
+
+    if path == xml.XPATH_GLOBAL_ALL_ATTRS:
+        return Path(None, (), TARGET_GLOBAL_ATTRS, None)
+
+    for suffix, target in ((_STEP_SUBTREE_ATTRS, TARGET_SUBTREE_ATTRS),
+                           (_STEP_SUBTREE, TARGET_SUBTREE)):
+        if not path.endswith(suffix):
+            continue
+
+        location = path[:-len(suffix)]
+
+        if not location:
+            return None
+
+        steps = _parse_steps(location.split(xml.XPATH_SELECT_OPERATOR))
+
+        if steps is None:
+            # Let lxml find the subtree roots.
+            return Path(location, None, target, None)
+
+        return Path(None, steps, target, None)
+
+    steps = path.split(xml.XPATH_SELECT_OPERATOR)
+    last = steps[-1]
+    name = None
+
+    if last == xml.XPATH_AXIS_SELF_NODE:
+        target = TARGET_SELF
+        steps = steps[:-1]
+    elif last == xml.SELECTOR_TEXT:
+        target = TARGET_TEXT
+        steps = steps[:-1]
+    elif last == xml.XPATH_WILDCARD_ALL_ATTRS:
+        target = TARGET_ALL_ATTRS
+        steps = steps[:-1]
+    elif last.startswith(_ATTR_PREFIX):
+        match = _RE_QNAME.match(last[len(_ATTR_PREFIX):])
+
+        if match is None:
+            return None
+
+        target = TARGET_ATTRIBUTE
+        name = match.groups()
+        steps = steps[:-1]
+    else:
+        target = TARGET_SELF
+
+    steps = _parse_steps(steps)
+
+    if steps is None:
+        return None
+
+    return Path(None, steps, target, name)
+
+
+def classify(xpath):
+    """Parse the Controlled_Structure expression `xpath` into Path tuples.
+
+    Args:
+        xpath: An XPath expression string.
+
+    Returns:
+        A list of Path tuples, one per member of the XPath union, or None if
+        any member does not fit a known shape.
+    """
+    paths = [_parse_path(x) for x in split_union(xpath)]
+
+    if not paths or None in paths:
+        return None
+
+    return paths
+
+
+def shape(paths):
+    """Return the SHAPE_* value which describes the list of Path tuples
+    `paths`, or SHAPE_XPATH if `paths` is None.
+    """
+    if paths is None:
+        return SHAPE_XPATH
+
+    targets = set(x.target for x in paths)
+
+    if targets <= set([TARGET_GLOBAL, TARGET_GLOBAL_ATTRS]):
+        return SHAPE_GLOBAL
+
+    if targets & set([TARGET_SUBTREE, TARGET_SUBTREE_ATTRS]):
+        return SHAPE_SUBTREE
+
+    if TARGET_SELF in targets:
+        return SHAPE_NODE
+
+    return SHAPE_FIELD
+
+
+def qualify(prefix, localname, namespaces):
+    """Return the Clark notation (``{namespace}localname``) name for the
+    `prefix` and `localname` pair, or None if `prefix` is not defined in
+    `namespaces`.
+    """
+    if prefix is None:
+        return localname
+
+    namespace = namespaces.get(prefix)
+
+    if namespace is None:
+        return None
+
+    return "{%s}%s" % (namespace, localname)
+
+
+def walk(control, path, namespaces):
+    """Return the elements the location path of `path` selects, relative to
+    the Controlled_Structure element `control`.
+
+    Args:
+        control: A Controlled_Structure lxml Element object.
+        path: A Path tuple.
+        namespaces: A dictionary which maps prefixes to namespaces.
+
+    Returns:
+        A list of lxml Elements or None if the path cannot be resolved to
+        elements this way (e.g., it steps above the root element, uses an
+        undefined prefix, or its `start` XPath fails or selects other
+        nodes).
+    """
+    if path.start is not None:
+        try:
+            nodes = xml.compile_xpath(path.start, namespaces)(control)
+        except etree.XPathError:
+            return None
+
+        if not isinstance(nodes, list) or not all(xml.is_element(x) for x in nodes):
+            return None
+
+        return nodes
+
+    nodes = [control]
+
+    for step in path.steps:
+        selected = []
+        seen = set()
+
+        if step[0] == STEP_PARENT:
+            for node in nodes:
+                parent = node.getparent()
+
+                if parent is None:
+                    return None
+
+                if parent not in seen:
+                    seen.add(parent)
+                    selected.append(parent)
+        else:
+            _, prefix, localname, position = step
+            tag = qualify(prefix, localname, namespaces)
+
+            if tag is None:
+                return None
+
+            for node in nodes:
+                children = list(node.iterchildren(tag))
+
+                if position is None:
+                    selected.extend(children)
+                elif 0 < position <= len(children):
+                    selected.append(children[position - 1])
+
+        nodes = selected
+
+    return nodes
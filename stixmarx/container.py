@@ -13,7 +13,9 @@ inside a MarkingSpecification object and supply that object to the API.
 
 # stdlib
 import collections
+import copy
 import itertools
+import weakref
 
 # internal
 from stixmarx import api
@@ -21,10 +23,34 @@ from stixmarx import errors
 from stixmarx import navigator
 from stixmarx import serializer
 from stixmarx import utils
+from stixmarx.api import types
 
 __all__ = ['MarkingContainer']
 
 
+class _StrongRef(object):
+    """Stands in for a weak reference to an object which does not support
+    weak references (e.g., a built-in str).
+    """
+    __slots__ = ("_obj",)
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __call__(self):
+        return self._obj
+
+
+def _ref(obj):
+    """Return a weak reference to `obj`, or a _StrongRef if `obj` does not
+    support weak references.
+    """
+    try:
+        return weakref.ref(obj)
+    except TypeError:
+        return _StrongRef(obj)
+
+
 class MarkingContainer(object):
     """Enables the operation of data markings on STIX, CybOX and MAEC objects.
     
@@ -50,24 +76,91 @@ class MarkingContainer(object):
         null_markings: (list of MarkingSpecification): List of markings that
             apply to this container but, will NOT mark anything inside. This
             means, no controlled structure will be resolved for this objects.
+
+    Note:
+        When created by ``stixmarx.parse(..., lazy=True)``, the markings
+        parsed from the input document are attached to an entity (and its
+        non-Entity fields, such as ``indicator.title``) the first time
+        get_markings() or is_marked() is called for that entity. Querying a
+        non-Entity value, or removing or clearing markings, resolves every
+        pending entity first. A field value read before its entity was
+        resolved is queried through the marked copy which replaced it.
     """
 
-    def __init__(self, package):
+    def __init__(self, package, resolver=None):
         """Initialize a MarkingContainer object.
 
         Args:
             package: A stix.core.STIXPackage object.
+            resolver: A lazy stixmarx.parser.MarkingParser which parsed
+                `package`, or None if markings were resolved during parse.
         """
         self._field_markings = collections.defaultdict(list)
         self._global_markings = []
         self._null_markings = []
 
+        # Sets which mirror _field_markings and _global_markings so that
+        # add_marking() and add_global() can check for duplicates without
+        # scanning the lists.
+        self._field_marking_keys = collections.defaultdict(set)
+        self._global_marking_keys = set()
+
         self._package = package
+        self._resolver = resolver
+
+        # Maps the ids of values replaced by marked copies during a lazy
+        # resolution to (value, copy) tuples. Filled by the resolver.
+        self._replaced = resolver.replaced if resolver is not None else {}
+
+        # Maps each MarkingSpecification to the objects it is attached to,
+        # keyed by object id. Built on first use by _index_marked_objects().
+        self._marked_objects = None
+
+        # Maps object ids to (object, effective markings) tuples. Built on
+        # first use by _propagate_markings() and dropped on every change.
+        self._effective_markings = None
+
+        # Component markings (descendants=True), recorded once on their root
+        # object. Maps root ids to (root, markings) tuples.
+        self._scopes = {}
+
+        # Maps object ids to (reference, {parent id: parent reference})
+        # tuples. Built on first use by _index_parents(). _parent_misses
+        # maps the ids of objects which were not found in the current index
+        # to references to them.
+        self._parents = None
+        self._parent_misses = {}
+
+        # Bumped by every marking change made through the container. Output
+        # cached by to_xml() and to_dict() is keyed by it.
+        self._version = 0
+        self._output_cache = {}
+
+    def __getstate__(self):
+        # The id-keyed indexes do not survive pickling. They are rebuilt on
+        # first use, except for _scopes which is rekeyed by __setstate__().
+        state = self.__dict__.copy()
+        state["_marked_objects"] = None
+        state["_effective_markings"] = None
+        state["_parents"] = None
+        state["_parent_misses"] = {}
+        state["_output_cache"] = {}
+        state["_scopes"] = list(self._scopes.values())
+        state["_replaced"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._scopes = dict((id(root), (root, markings))
+                            for root, markings in state["_scopes"])
 
     def _reset_collections(self):
         self._field_markings = collections.defaultdict(list)
         self._global_markings = []
         self._null_markings = []
+        self._field_marking_keys = collections.defaultdict(set)
+        self._global_marking_keys = set()
+        self._invalidate_effective_markings()
 
     @property
     def global_markings(self):
@@ -117,21 +210,335 @@ class MarkingContainer(object):
         """Package wrapped by this MarkingContainer"""
         return self._package
 
-    def _add_descendants(self, markable, marking):
-        """Apply marking to `markable` in-place to descendants."""
-        for descendant in navigator.iterwalk(markable):
-            descendant = api.add_marking(descendant, marking)
+    def _resolve(self, markable):
+        """Attach the parsed marking information to `markable` if it is
+        still pending in a lazy parse.
+
+        A non-Entity value (e.g., ``indicator.title``) cannot be traced back
+        to the entity it was parsed into, so every pending entity is resolved
+        when one is queried.
+
+        Returns:
+            The object which holds the markings of `markable`. See
+            _replacement().
+        """
+        if self._resolver is not None:
+            if utils.is_entity(markable):
+                self._resolver.resolve(markable)
+            else:
+                self._resolver.resolve_all()
+
+            if self._resolver.resolved:
+                self._resolver = None
+
+        return self._replacement(markable)
+
+    def _replacement(self, markable):
+        """Return the marked copy which replaced `markable` in its entity
+        when the entity was lazily resolved, or `markable` itself.
+
+        This lets a field value read before its entity was resolved (e.g.,
+        ``title = indicator.title``) be queried and marked like the value
+        the entity now holds.
+        """
+        found = self._replaced.get(id(markable))
+
+        if found is None or found[0] is not markable or found[1] is None:
+            return markable
+
+        return found[1]
+
+    def _resolve_all(self):
+        """Attach the parsed marking information to every entity that is
+        still pending in a lazy parse.
+        """
+        if self._resolver is None:
+            return
+
+        self._resolver.resolve_all()
+        self._resolver = None
+
+    def _index_marked_objects(self):
+        """Build the index of marked objects with one walk of the package,
+        if it has not been built yet.
+        """
+        if self._marked_objects is not None:
+            return
+
+        self._resolve_all()
+        self._marked_objects = {}
+
+        walk = itertools.chain((self._package,), navigator.iterwalk(self._package))
+
+        for obj in walk:
+            for marking in api.get_markings(obj):
+                self._index_add(obj, marking)
+
+    def _index_add(self, obj, marking):
+        """Record that `obj` is marked by `marking`."""
+        if self._marked_objects is None:
+            return
+
+        marked = self._marked_objects.setdefault(marking, {})
+        marked[id(obj)] = obj
+
+    def _index_remove(self, obj, marking):
+        """Record that `obj` is no longer marked by `marking`."""
+        if self._marked_objects is None:
+            return
+
+        marked = self._marked_objects.get(marking)
+
+        if marked is None:
+            return
+
+        marked.pop(id(obj), None)
+
+        if not marked:
+            del self._marked_objects[marking]
+
+    def _clear_marking_info(self, markable):
+        """Clear the markings from `markable` and remove it from the index
+        of marked objects.
+        """
+        for marking in api.get_markings(markable):
+            self._index_remove(markable, marking)
+
+        api.clear_markings(markable)
+
+    def _invalidate_effective_markings(self):
+        """Drop the effective markings computed by _propagate_markings()."""
+        self._effective_markings = None
+
+    def _touch(self):
+        """Record a marking change: bump the container version, which
+        invalidates cached output, and drop the effective markings.
+        """
+        self._version += 1
+        self._invalidate_effective_markings()
+
+    def _get_cached_output(self, kind, args, kwargs):
+        """Return the output cached by to_xml() or to_dict() for `kind` if it
+        was produced with the same arguments at the current version, else
+        None.
+        """
+        cached = self._output_cache.get(kind)
+
+        if cached is None:
+            return None
+
+        version, cached_args, cached_kwargs, output = cached
+
+        if (version != self._version or cached_args != args or
+                cached_kwargs != kwargs):
+            return None
+
+        return output
+
+    def _set_cached_output(self, kind, args, kwargs, output):
+        """Cache the to_xml() or to_dict() `output` for `kind`."""
+        self._output_cache[kind] = (self._version, args, kwargs, output)
+
+    def _get_serializer(self, kwargs):
+        """Return a MarkingSerializer for this container, taking its options
+        out of the to_xml() or to_dict() keyword arguments `kwargs`.
+        """
+        return serializer.MarkingSerializer(
+            marking_container=self,
+            coalesce=kwargs.pop("coalesce", False),
+            max_xpath_length=kwargs.pop("max_xpath_length", None)
+        )
+
+    def _propagate_markings(self):
+        """Compute the effective markings of every object in the package with
+        one top-down walk, if they have not been computed yet.
+
+        The effective markings of an object are its own markings plus the
+        markings it inherits: the global markings, the package's markings
+        (parsed from document-level Handling) and the component markings
+        (added with descendants=True) of its ancestors. Markings which only
+        apply to an ancestor itself are not inherited.
+        """
+        if self._effective_markings is not None:
+            return
+
+        self._resolve_all()
+
+        package = self._package
+        own = frozenset(itertools.chain(self._global_markings, api.get_markings(package)))
+        effective = {id(package): (package, own)}
+
+        # Maps entity ids to the markings their descendants inherit.
+        inheritable = {id(package): own}
+
+        for ancestors, _, obj in navigator.iterpath(package):
+            if obj is None:
+                continue
+
+            inherited = inheritable[id(ancestors[-1])]
+            scope = self._scopes.get(id(obj))
+
+            if scope is not None and scope[0] is obj and scope[1]:
+                inherited = inherited.union(scope[1])
+
+            inheritable[id(obj)] = inherited
+            markings = api.get_markings(obj)
+
+            if markings:
+                inherited = inherited.union(markings)
+
+            # The same (e.g., interned immutable) object may be found at
+            # several places in the package.
+            if id(obj) in effective:
+                inherited = inherited | effective[id(obj)][1]
+
+            effective[id(obj)] = (obj, inherited)
+
+        self._effective_markings = effective
+
+    def _index_parents(self):
+        """Build the index of the parents of every object in the package with
+        one walk, if it has not been built yet.
+
+        Built-in immutable values (e.g., an unmarked str) are not indexed:
+        the same object may be held by several unrelated entities, so its
+        identity does not tell which of them holds it.
+        """
+        if self._parents is not None:
+            return
+
+        self._parents = {}
+        self._parent_misses = {}
+
+        for ancestors, _, obj in navigator.iterpath(self._package):
+            if obj is not None and not types.is_castable(obj):
+                self._add_parent(obj, ancestors[-1])
+
+    def _add_parent(self, obj, parent):
+        """Record `parent` as a parent of `obj` in the parent index."""
+        entry = self._parents.get(id(obj))
+
+        if entry is None or entry[0]() is not obj:
+            entry = (_ref(obj), {})
+            self._parents[id(obj)] = entry
+
+        if id(parent) not in entry[1]:
+            entry[1][id(parent)] = _ref(parent)
+
+    def _get_parents(self, obj):
+        """Return the parents of `obj` found in the parent index, or None if
+        `obj` is not in the index.
+        """
+        entry = self._parents.get(id(obj))
+
+        if entry is None or entry[0]() is not obj:
+            return None
+
+        return [x for x in (ref() for ref in entry[1].values()) if x is not None]
+
+    def _get_ancestors(self, markable):
+        """Return the ancestors of `markable`, nearest first, by climbing the
+        parent index.
+
+        If `markable` is not in the index (e.g., it was added to the package
+        after the index was built), the index is rebuilt, unless `markable`
+        was already missing from the current index.
+
+        Returns:
+            A list of objects, or None if `markable` is a built-in immutable
+            value or is not in the package.
+        """
+        if markable is self._package:
+            return []
+
+        if types.is_castable(markable):
+            return None
+
+        self._index_parents()
+
+        if self._get_parents(markable) is None:
+            missed = self._parent_misses.get(id(markable))
+
+            if missed is not None and missed() is markable:
+                return None
+
+            self._parents = None
+            self._index_parents()
+
+            if self._get_parents(markable) is None:
+                self._parent_misses[id(markable)] = _ref(markable)
+                return None
+
+        ancestors = []
+        seen = set()
+        queue = collections.deque([markable])
+
+        while queue:
+            for parent in self._get_parents(queue.popleft()) or ():
+                if id(parent) in seen:
+                    continue
+
+                seen.add(id(parent))
+                ancestors.append(parent)
+                queue.append(parent)
+
+        return ancestors
+
+    def _add_scope(self, markable, marking):
+        """Record `marking` as a component marking of `markable`. It applies
+        to the descendants of `markable` without being attached to them.
+        """
+        scope = self._scopes.setdefault(id(markable), (markable, []))
+        scope[1].append(marking)
+
+    def _remove_scope(self, markable, marking=None):
+        """Remove the component marking `marking` (or all component markings
+        if `marking` is None) recorded on `markable`.
+        """
+        scope = self._scopes.get(id(markable))
+
+        if scope is None or scope[0] is not markable:
+            return
+
+        if marking is None:
+            del scope[1][:]
+        elif marking in scope[1]:
+            scope[1].remove(marking)
+
+        if not scope[1]:
+            del self._scopes[id(markable)]
+
+    def _scope_markings(self, markable):
+        """Return the component markings which `markable` inherits from its
+        ancestors.
+        """
+        if not self._scopes:
+            return ()
+
+        markings = set()
+
+        for ancestor in self._get_ancestors(markable) or ():
+            scope = self._scopes.get(id(ancestor))
+
+            if scope is not None and scope[0] is ancestor:
+                markings.update(scope[1])
+
+        return markings
 
     def _remove_descendants(self, markable, marking):
         """Remove marking from the `markable` descendants."""
         for descendant in navigator.iterwalk(markable):
             if api.contains_marking(descendant, marking):
                 api.remove_marking(descendant, marking)
+                self._index_remove(descendant, marking)
 
     def _clear_descendants(self, markable):
         """Clear markings from the `markable` descendants."""
         for descendant in navigator.iterwalk(markable):
-            api.clear_markings(descendant)
+            self._clear_marking_info(descendant)
+
+            if id(descendant) in self._scopes:
+                self._remove_scope(descendant)
 
     def _get_descendants(self, markable):
         """Return unique markings from the `markable` descendants."""
@@ -159,11 +566,25 @@ class MarkingContainer(object):
         """Assert that the input `markable` object is not marked by `marking`.
         If `markable` is already marked by `marking`, raise an error.
 
+        This checks the same markings as is_marked(), but with set lookups
+        instead of building the list of every marking on `markable`.
+
         Raises:
+            errors.UnmarkableError: If `markable` is not a markable entity.
             errors.DuplicateMarkingError: If `markable` is already marked by
                 `marking`.
         """
-        is_duplicate = self.is_marked(markable, marking=marking)
+        if not api.is_markable(markable):
+            msg = "Could not verify markings to unmarkable entity."
+            raise errors.UnmarkableError(entity=markable, message=msg)
+
+        self._resolve(markable)
+
+        is_duplicate = (
+            marking in self._global_marking_keys or
+            api.contains_marking(markable, marking) or
+            marking in self._scope_markings(markable)
+        )
 
         if not is_duplicate:
             return
@@ -218,7 +639,9 @@ class MarkingContainer(object):
             markable: An object to mark (e.g., an Indicator.title string).
             marking: A python-stix MarkingSpecification object.
             descendants: If true, add the marking to all descendants
-                `markable`.
+                `markable`. The marking is recorded once, as a component
+                marking of `markable`, and is not attached to each
+                descendant.
 
         Returns:
             The `markable` object with data marking information attached. If
@@ -234,6 +657,56 @@ class MarkingContainer(object):
         utils.check_marking(marking)
         utils.check_empty_marking(marking)
 
+        self._touch()
+        return self._add_marking(markable, marking, descendants)
+
+    def add_markings_bulk(self, markings):
+        """Add many markings with one call. Each item of `markings` is a
+        ``(markable, marking, descendants)`` tuple, applied as if passed to
+        add_marking().
+
+        Each distinct MarkingSpecification is validated once, no matter how
+        many items it appears in, and component markings are recorded
+        without walking the marked subtrees.
+
+        Note:
+            Items are applied in order. If an item raises an error, the
+            items before it remain applied.
+
+        Args:
+            markings: An iterable of ``(markable, marking, descendants)``
+                tuples.
+
+        Returns:
+            list: The add_marking() return value for each item, in input
+                order. Set each immutable field (e.g., a str title) to its
+                returned value.
+
+        Raises:
+            UnmarkableError: If a `markable` is a STIXPackage object.
+            UnknownMarkingError: If a `marking` is not a MarkingSpecification
+                object.
+            DuplicateMarkingError: If a `markable` is already marked by its
+                `marking`.
+            MarkingPathNotEmpty: If a `marking` controlled_structure is set.
+        """
+        self._touch()
+
+        checked = set()
+        results = []
+
+        for markable, marking, descendants in markings:
+            if id(marking) not in checked:
+                utils.check_marking(marking)
+                utils.check_empty_marking(marking)
+                checked.add(id(marking))
+
+            results.append(self._add_marking(markable, marking, descendants))
+
+        return results
+
+    def _add_marking(self, markable, marking, descendants):
+        """Add the validated `marking` to `markable`. See add_marking()."""
         # Handles null marking case.
         if markable is None:
             if marking not in self._null_markings:
@@ -248,19 +721,23 @@ class MarkingContainer(object):
                                                    marking=marking)
 
         self._assert_unique_marking(markable, marking)
+        markable = self._replacement(markable)
 
         # API call before to avoid duplicates.
         marked = api.add_marking(markable, marking)
 
         if not utils.is_package(markable):
-            if all((marking, descendants) != mark
-                   for mark in self._field_markings[marked]):
+            key = (marking, descendants)
+
+            if key not in self._field_marking_keys[marked]:
 
                 if descendants:
-                    self._add_descendants(markable, marking)
+                    self._add_scope(marked, marking)
 
                 # Store marking and descendants option tied.
-                self._field_markings[marked].append((marking, descendants))
+                self._field_markings[marked].append(key)
+                self._field_marking_keys[marked].add(key)
+                self._index_add(marked, marking)
                 return marked
 
             msg = ("The marking is already present in the field_markings"
@@ -292,9 +769,11 @@ class MarkingContainer(object):
         """
         utils.check_marking(marking)
         utils.check_empty_marking(marking)
+        self._touch()
 
-        if marking not in self._global_markings:
+        if marking not in self._global_marking_keys:
             self._global_markings.append(marking)
+            self._global_marking_keys.add(marking)
             return
 
         msg = ("The marking is already present in the global_markings"
@@ -304,7 +783,7 @@ class MarkingContainer(object):
                                            entity=self.package,
                                            marking=marking)
 
-    def flush(self):
+    def flush(self, coalesce=False, max_xpath_length=None):
         """Flush markings onto package object.
 
         Markings are buffered in the MarkingContainer until explicitly flushed
@@ -313,11 +792,23 @@ class MarkingContainer(object):
         Note:
             The global and fields collection will reset after this call.
 
+        Args:
+            coalesce: If True, a marking applied to several fields which share
+                a Handling is written as one Marking whose
+                controlled_structure is the union of the fields' XPaths.
+            max_xpath_length: The maximum length of a coalesced
+                controlled_structure. Longer unions are split across several
+                Markings. If None, there is no limit.
+
         Returns:
             stix.core.STIXPackage: A STIX Package with all makings explicitly
                 applied from the container.
         """
-        writer = serializer.MarkingSerializer(marking_container=self)
+        writer = serializer.MarkingSerializer(
+            marking_container=self,
+            coalesce=coalesce,
+            max_xpath_length=max_xpath_length
+        )
         writer._apply_markings()
 
         # Reset the collections so we don't return duplicates
@@ -345,6 +836,10 @@ class MarkingContainer(object):
         Returns:
             list: A list of MarkingSpecification objects.
         """
+        if descendants:
+            self._resolve_all()
+
+        markable = self._resolve(markable)
         item_markings = api.get_markings(markable)
         descendant_markings_collection = ()
         null_markings_collection = ()
@@ -358,12 +853,81 @@ class MarkingContainer(object):
         all_markings = itertools.chain(
             self._global_markings,
             item_markings,
+            self._scope_markings(markable),
             descendant_markings_collection,
             null_markings_collection
         )
 
         return list(set(all_markings))
 
+    def get_effective_markings(self, markable):
+        """Return every marking which applies to `markable`: its own
+        markings, the component markings of its ancestors in the package,
+        the markings parsed from document-level Handling and the global
+        markings.
+
+        The first call computes the effective markings of every object in
+        the package with one walk. Later calls are dictionary lookups until
+        a marking is added, removed or cleared through the MarkingContainer.
+
+        Note:
+            Markings attached or removed through the stixmarx.api functions
+            are not seen until the MarkingContainer is next changed. An
+            immutable object found at several places in the package (e.g.,
+            an unmarked string) gets the markings of all of those places.
+
+        Args:
+            markable: A markable object (e.g., indicator.title).
+
+        Returns:
+            list: A list of MarkingSpecification objects.
+        """
+        self._propagate_markings()
+
+        found = self._effective_markings.get(id(markable))
+
+        if found is not None and found[0] is markable:
+            return list(found[1])
+
+        # Not part of the package, or read before a lazy resolution.
+        markable = self._resolve(markable)
+        found = self._effective_markings.get(id(markable))
+
+        if found is not None and found[0] is markable:
+            return list(found[1])
+
+        return list(set(itertools.chain(self._global_markings, api.get_markings(markable))))
+
+    def get_marked_objects(self, marking):
+        """Return the objects which `marking` is attached to.
+
+        The first call walks the package once to index every marked object.
+        The index is then kept current by the MarkingContainer methods which
+        add, remove or clear markings, so later calls only take time
+        proportional to the number of objects returned.
+
+        Note:
+            Markings added through add_global() are not attached to any
+            object and are not included. Markings attached or removed
+            through the stixmarx.api functions after the first call are not
+            reflected.
+
+        Args:
+            marking: A MarkingSpecification object.
+
+        Raises:
+            UnknownMarkingError: If `marking` is not a MarkingSpecification
+                object.
+
+        Returns:
+            list: The marked objects (e.g., entities and markable field
+                values).
+        """
+        utils.check_marking(marking)
+        self._index_marked_objects()
+
+        return list(self._marked_objects.get(marking, {}).values())
+
     def is_marked(self, markable, marking=None, descendants=False):
         """Return True if `markable` contains marking information.
 
@@ -418,6 +982,9 @@ class MarkingContainer(object):
                 object.
         """
         utils.check_marking(marking)
+        self._resolve_all()
+        self._touch()
+        markable = self._replacement(markable)
 
         # Handles null marking case.
         if markable is None:
@@ -446,12 +1013,14 @@ class MarkingContainer(object):
                 try:
                     field_markings.remove((marking, descendants))
                     self._field_markings[markable] = field_markings
+                    self._field_marking_keys[markable].discard((marking, descendants))
 
                     if api.contains_marking(markable, marking):
                         api.remove_marking(markable, marking)
+                        self._index_remove(markable, marking)
 
                         if descendants:
-                            self._remove_descendants(markable, marking)
+                            self._remove_scope(markable, marking)
 
                     return
                 except (AttributeError, ValueError):
@@ -461,6 +1030,13 @@ class MarkingContainer(object):
                                                       message=msg,
                                                       marking=marking)
 
+            elif marking in self._scope_markings(markable):
+                msg = ("Unable to remove marking. Marking is inherited from "
+                       "an ancestor.")
+                raise errors.MarkingRemovalError(message=msg,
+                                                 entity=markable,
+                                                 marking=marking)
+
             # Attempt to remove marking from wrapped STIX Package.
             elif api.contains_marking(markable, marking):
 
@@ -471,23 +1047,25 @@ class MarkingContainer(object):
                                                      message=msg,
                                                      marking=marking)
 
-                for mark in navigator.iterwalk(self._package):
-                    if api.contains_marking(mark, marking):
-                        if mark is markable:
-                            api.remove_marking(markable, marking)
+                ancestors = self._get_ancestors(markable) or ()
 
-                            if descendants:
-                                self._remove_descendants(markable, marking)
+                if any(api.contains_marking(x, marking) for x in ancestors):
+                    msg = ("Unable to remove marking. Marking is "
+                           "inherited from an ancestor.")
+                    raise errors.MarkingRemovalError(message=msg,
+                                                     entity=markable,
+                                                     marking=marking)
 
-                            self._remove_marking_specification(marking)
+                api.remove_marking(markable, marking)
+                self._index_remove(markable, marking)
 
-                            return
-                        else:
-                            msg = ("Unable to remove marking. Marking is "
-                                   "inherited from an ancestor.")
-                            raise errors.MarkingRemovalError(message=msg,
-                                                             entity=markable,
-                                                             marking=marking)
+                if descendants:
+                    self._remove_descendants(markable, marking)
+                    self._remove_scope(markable, marking)
+
+                self._remove_marking_specification(marking)
+
+                return
 
             msg = "Unable to remove marking from markable. Marking not found."
             raise errors.MarkingNotFoundError(entity=markable, message=msg,
@@ -499,6 +1077,11 @@ class MarkingContainer(object):
     def clear_markings(self, markable, descendants=False):
         """Remove all markings from the `markable` marked object.
 
+        Note:
+            Component markings of `markable` (and of its descendants if
+            `descendants` is True) are removed. Component markings inherited
+            from an ancestor still apply.
+
         Args:
             markable: A marked object (e.g., indicator.title)
             descendants: If True, clear markings from `markable` and
@@ -508,7 +1091,11 @@ class MarkingContainer(object):
             UnmarkableError: If `markable` is not an markable entity.
         """
         if api.is_markable(markable):
-            api.clear_markings(markable)
+            self._resolve_all()
+            self._touch()
+            markable = self._replacement(markable)
+            self._clear_marking_info(markable)
+            self._remove_scope(markable)
 
             if descendants:
                 self._clear_descendants(markable)
@@ -530,11 +1117,14 @@ class MarkingContainer(object):
                 global markings registry.
         """
         utils.check_marking(marking)
+        self._resolve_all()
+        self._touch()
 
         # Attempt to remove marking from internal collection
-        if marking in self._global_markings:
+        if marking in self._global_marking_keys:
             try:
                 self._global_markings.remove(marking)
+                self._global_marking_keys.discard(marking)
                 return
             except (AttributeError, ValueError):
                 pass
@@ -546,6 +1136,7 @@ class MarkingContainer(object):
             if marking in global_markings:
                 try:
                     api.remove_marking(self._package, marking)
+                    self._index_remove(self._package, marking)
                     self._remove_descendants(self._package, marking)
                     self._remove_marking_specification(marking)
                     return
@@ -561,26 +1152,89 @@ class MarkingContainer(object):
         """Return an XML string of the STIX package represented by the Package
         object, with markings applied through the MarkingContainer.
         
-        Uses the same arguments as ``stix.Entity.to_xml()``.
+        Uses the same arguments as ``stix.Entity.to_xml()``, plus the
+        `coalesce` and `max_xpath_length` keyword arguments of flush() and the
+        `use_cache` keyword argument. If `use_cache` is True and no marking
+        has been added, removed or cleared through the MarkingContainer since
+        the last ``to_xml(..., use_cache=True)`` call with the same
+        arguments, the output of that call is returned.
+
+        Note:
+            Only the markings added since the last serialization are
+            resolved to XPaths: the earlier ones are already part of the
+            package's Handling. Changes made directly to the package do not
+            invalidate the cached output. Do not pass `use_cache` if the
+            package may have been changed.
         """
-        writer = serializer.MarkingSerializer(marking_container=self)
+        use_cache = kwargs.pop("use_cache", False)
+
+        if use_cache:
+            xml_out = self._get_cached_output("xml", args, kwargs)
+
+            if xml_out is not None:
+                return xml_out
+
+        cache_kwargs = dict(kwargs)
+        writer = self._get_serializer(kwargs)
         xml_out = writer.serialize_xml(*args, **kwargs)
 
         # Reset the collections so duplicates aren't returned
         self._reset_collections()
 
+        if use_cache:
+            self._set_cached_output("xml", args, cache_kwargs, xml_out)
+
         return xml_out
 
+    def write_xml(self, fileobj, encoding="utf-8", **kwargs):
+        """Write the XML of the STIX package represented by the Package
+        object, with markings applied through the MarkingContainer, to
+        `fileobj`.
+
+        Top-level objects are serialized and written one at a time, so the
+        serialized document is never held in memory as a whole.
+
+        Args:
+            fileobj: A file-like object with a write() method, or a filename.
+            encoding: The output encoding.
+            **kwargs: Keyword arguments from ``stix.Entity.to_xml()``, other
+                than `encoding`, plus the `coalesce` and `max_xpath_length`
+                keyword arguments of flush().
+        """
+        writer = self._get_serializer(kwargs)
+        writer.write_xml(fileobj, encoding, **kwargs)
+
+        # Reset the collections so duplicates aren't returned
+        self._reset_collections()
+
     def to_dict(self, *args, **kwargs):
         """Return a dictionary of the STIX Package represented by the Package
         object, with markings applied through the MarkingContainer.
 
-        Uses the same arguments as ``stix.Entity.to_dict()``.
+        Uses the same arguments as ``stix.Entity.to_dict()``, plus the
+        `coalesce`, `max_xpath_length` and `use_cache` keyword arguments,
+        which work as they do for to_xml().
+        A copy of the cached dictionary is returned.
         """
-        writer = serializer.MarkingSerializer(marking_container=self)
+        use_cache = kwargs.pop("use_cache", False)
+
+        if use_cache:
+            dict_out = self._get_cached_output("dict", args, kwargs)
+
+            if dict_out is not None:
+                return copy.deepcopy(dict_out)
+
+        cache_kwargs = dict(kwargs)
+        writer = self._get_serializer(kwargs)
         dict_out = writer.serialize_dict(*args, **kwargs)
 
         # Reset the collections so duplicates aren't returned
         self._reset_collections()
 
+        if use_cache:
+            # Cache the serialized dictionary itself and hand out a copy,
+            # so each call copies it once.
+            self._set_cached_output("dict", args, cache_kwargs, dict_out)
+            return copy.deepcopy(dict_out)
+
         return dict_out
@@ -2,20 +2,16 @@
 # See LICENSE.txt for complete terms.
 
 # stdlib
+import collections
 import logging
 
 # external
-from mixbox.vendor.six import PY2, PY3
+from lxml import etree
 
 # internal
+from stixmarx import classifier
 from stixmarx import xml
 
-
-if PY2:
-    from collections import MutableMapping
-elif PY3:
-    from collections.abc import MutableMapping
-
 # Module-level logger
 LOG = logging.getLogger(__name__)
 
@@ -23,139 +19,294 @@ LOG = logging.getLogger(__name__)
 _NSMAP = {"marking": "http://data-marking.mitre.org/Marking-1"}
 
 
-class _XmlElement(object):
-    """Wraps an etree _Element object.
+class MarkingMap(object):
+    """Maps element, attribute and text nodes to the set of
+    MarkingSpecificationType nodes which mark them.
+
+    Elements are numbered once, in document order, when the MarkingMap is
+    created. Marking sets are stored in dictionaries keyed by those numbers:
+    one for elements, one for the text and one for the tail text of each
+    element, and one which maps each element to a dictionary of its
+    attribute names. Looking up a node therefore needs no wrapper object
+    and never hashes attribute or text values.
+
+    Markings which apply to every element and text node (``//node()``)
+    and/or every attribute (``//@*``) of the document are stored once, as
+    document-level markings. Markings which apply to the subtree of an
+    element (``descendant-or-self::node()`` and/or
+    ``descendant-or-self::node()/@*``) are stored once, under the number of
+    the subtree's root element, and are found by climbing from a node to
+    the document root. Both are merged into the value
+    returned for every node they apply to. Such nodes are not counted
+    unless they are also marked directly.
 
-    This is used to represent XML element objects in a NodeSet collection and
-    provides an interface consistent with _XmlAttribute (e.g., they both have
-    a `sourcenode` attribute).
+    Args:
+        root: An lxml Element of the document. Every element in the
+            document is numbered, not only those under `root`.
 
+    Attributes:
+        stats: A Counter which maps classifier.SHAPE_* values to the
+            number of Controlled_Structures of that shape added by build().
     """
-    def __init__(self, node):
-        self.name = xml.localname(node)
-        self.sourcenode = node
 
-    def __eq__(self, other):
-        if other is self:
-            return True
+    def __init__(self, root):
+        docroot = root.getroottree().getroot()
+        nodes = docroot.iter(etree.Element)
+
+        self._ids = {}
+        self._parents = []
+
+        for idx, node in enumerate(nodes):
+            self._ids[node] = idx
+            self._parents.append(self._ids.get(node.getparent(), -1))
 
+        self._elements = {}
+        self._attributes = {}
+        self._texts = {}
+        self._tails = {}
+        self._global_nodes = set()
+        self._global_attrs = set()
+        self._subtree_nodes = {}
+        self._subtree_attrs = {}
+        self.stats = collections.Counter()
+
+    def __len__(self):
+        count = len(self._elements) + len(self._texts) + len(self._tails)
+        return count + sum(len(x) for x in self._attributes.values())
+
+    def __contains__(self, item):
         try:
-            return other.sourcenode is self.sourcenode
-        except AttributeError:
+            if self._find(item) is not None:
+                return True
+
+            nid, globals_, subtrees = self._inherited_from(item)
+        except TypeError:
             return False
 
-    def __hash__(self):
-        return hash(self.sourcenode)
+        if globals_:
+            return True
 
+        while nid is not None and nid != -1 and subtrees:
+            if subtrees.get(nid):
+                return True
 
-class _XmlAttribute(object):
-    """Wraps an etree _ElementStringResult or _ElementUnicodeResult
-    object which represents an XML attribute.
+            nid = self._parents[nid]
 
-    An _ElementStringResult object subclasses `str` and a _ElementUnicodeResult
-    object subclasses `unicode`, so any two attributes that share the same
-    value will be considered equal and have equal hashes even if they belong
-    to two different XML elements.
+        return False
 
-    This class exists to distinguish attributes from each other by factoring
-    an attribute's parent into the equality check.
+    def __getitem__(self, key):
+        found = self._lookup(key)
 
-    Note: UTF-8 encoding was selected as default to provide support
-        for Unicode. If a consumer utilizes a different character encoding it
-        must be provided through stixmarx.parse(xml_input, encoding="...").
-    """
+        if found is None:
+            raise KeyError(key)
+
+        return found
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, TypeError):
+            return default
 
-    def __init__(self, node, encoding=None):
-        self.name = xml.localname(node.attrname)
-        self.parent = node.getparent()
-        self.sourcenode = node
-        self.encoding = "utf-8" if not encoding else encoding
+    def _find(self, node):
+        """Return the set of non-global markings stored for `node` or None
+        if `node` is not marked.
 
-    def __eq__(self, other):
-        """Return True if the `other` _XmlAttribute has the same parent
-        element, the same attribute name, and the same attribute value.
+        Raises:
+            TypeError: If `node` is not an element, attribute or text node.
         """
-        if other is self:
-            return True
+        if xml.is_element(node):
+            return self._elements.get(self._ids.get(node))
 
-        if other.__class__ != self.__class__:
-            return False
+        if xml.is_attribute(node):
+            attrs = self._attributes.get(self._ids.get(node.getparent()))
 
-        try:
-            return (other.sourcenode == self.sourcenode and
-                    other.name == self.name and
-                    other.parent is self.parent)
-        except AttributeError as ex:
-            LOG.warn(ex)
-            return False
+            if attrs is None:
+                return None
 
-    def __hash__(self):
-        return hash((self.name, self.sourcenode, self.parent))
+            return attrs.get(node.attrname)
 
+        if xml.is_content(node):
+            nid = self._ids.get(node.getparent())
 
-class MarkingMap(MutableMapping):
-    def __init__(self, encoding=None):
-        self._inner = {}
-        self._encoding = encoding
+            if node.is_tail:
+                return self._tails.get(nid)
 
-    def __delitem__(self, key):
-        return self._inner.__delitem__(self._make_key(key))
+            return self._texts.get(nid)
 
-    def __len__(self):
-        return self._inner.__len__()
+        raise TypeError("Unexpected type: %s" % type(node))
 
-    def __iter__(self):
-        return self._inner.__iter__()
+    def _slot(self, node):
+        """Return the set of non-global markings stored for `node`, creating
+        it if `node` is not marked yet.
 
-    def __getitem__(self, key):
-        return self._inner.__getitem__(self._make_key(key))
-
-    def _make_key(self, node):
-        if isinstance(node, (_XmlAttribute, _XmlElement)):
-            return node
-        elif xml.is_element(node):
-            return _XmlElement(node)
-        elif xml.is_attribute(node):
-            return _XmlAttribute(node, self._encoding)
-        elif xml.is_content(node):
-            return _XmlAttribute(node, self._encoding)
-        else:
-            raise TypeError("Unexpected type: %s", type(node))
+        Raises:
+            TypeError: If `node` is not an element, attribute or text node.
+        """
+        if xml.is_element(node):
+            return self._elements.setdefault(self._ids[node], set())
 
-    def __contains__(self, item):
-        """Override the super() __contains__ which may raise a TypeError from
-        _make_key().
+        if xml.is_attribute(node):
+            nid = self._ids[node.getparent()]
+            attrs = self._attributes.setdefault(nid, {})
+            return attrs.setdefault(node.attrname, set())
+
+        if xml.is_content(node):
+            nid = self._ids[node.getparent()]
+
+            if node.is_tail:
+                return self._tails.setdefault(nid, set())
+
+            return self._texts.setdefault(nid, set())
+
+        raise TypeError("Unexpected type: %s" % type(node))
+
+    def _lookup(self, node):
+        """Return the set of markings which apply to `node`, or None if
+        `node` is not marked.
+
+        Raises:
+            TypeError: If `node` is not an element, attribute or text node.
         """
-        try:
-            return super(MarkingMap, self).__contains__(item)
-        except TypeError:
-            return False
+        found = self._find(node)
+        inherited = self._get_inherited(node)
 
-    def __setitem__(self, key, value):
-        key = self._make_key(key)
-        self._inner[key] = value
+        if not inherited:
+            return found
 
-    def add(self, key, value):
-        key = self._make_key(key)  # Reduce the amount of casting
+        if found is None:
+            return set(inherited)
 
-        if key not in self:
-            self[key] = set()
+        return found | inherited
 
-        self[key].add(value)
+    def _inherited_from(self, node):
+        """Return the number of the element whose subtrees `node` is in,
+        and the document-level and subtree markings which could apply to
+        `node`.
 
-    def extend(self, key, values):
-        key = self._make_key(key)   # Reduce the amount of casting
+        Returns:
+            A ``(nid, globals, subtrees)`` tuple. `nid` is None if `node` is
+            not in the document.
+
+        Raises:
+            TypeError: If `node` is not an element, attribute or text node.
+        """
+        if xml.is_element(node):
+            return self._ids.get(node), self._global_nodes, self._subtree_nodes
+
+        if xml.is_attribute(node):
+            nid = self._ids.get(node.getparent())
+            return nid, self._global_attrs, self._subtree_attrs
+
+        if xml.is_content(node):
+            nid = self._ids.get(node.getparent())
+
+            # Tail text is part of the subtrees its element's parent is in.
+            if node.is_tail and nid is not None:
+                nid = self._parents[nid]
+
+            return nid, self._global_nodes, self._subtree_nodes
 
-        if key not in self:
-            self[key] = set()
+        raise TypeError("Unexpected type: %s" % type(node))
 
-        self[key].update(values)
+    def _get_inherited(self, node):
+        """Return the document-level and subtree markings which apply to
+        `node`.
+
+        Raises:
+            TypeError: If `node` is not an element, attribute or text node.
+        """
+        nid, globals_, subtrees = self._inherited_from(node)
+
+        if nid is None or not subtrees:
+            return globals_
+
+        found = None
+
+        while nid != -1:
+            values = subtrees.get(nid)
+
+            if values:
+                found = globals_.union(values) if found is None else found | values
+
+            nid = self._parents[nid]
+
+        if found is None:
+            return globals_
+
+        return found
+
+    def add(self, key, value):
+        self._slot(key).add(value)
+
+    def extend(self, key, values):
+        self._slot(key).update(values)
 
     def addall(self, keys, value):
         """Add `value` to each key found in `keys`."""
         for key in keys:
             self.add(key, value)
 
+    def addattribute(self, element, attrname, value):
+        """Add `value` to the `attrname` attribute of `element`.
+
+        Args:
+            element: An lxml Element of the document.
+            attrname: An attribute name, in Clark notation if namespaced.
+            value: A MarkingSpecificationType node.
+        """
+        attrs = self._attributes.setdefault(self._ids[element], {})
+        attrs.setdefault(attrname, set()).add(value)
+
+    def addtext(self, element, value):
+        """Add `value` to the text node children of `element` (its text and
+        the tail text of its children).
+
+        Args:
+            element: An lxml Element of the document.
+            value: A MarkingSpecificationType node.
+        """
+        if element.text is not None:
+            self._texts.setdefault(self._ids[element], set()).add(value)
+
+        for child in element:
+            nid = self._ids.get(child)
+
+            if nid is not None and child.tail is not None:
+                self._tails.setdefault(nid, set()).add(value)
+
+    def addglobal(self, value, attributes=False):
+        """Add `value` as a document-level marking to every element and text
+        node, or to every attribute if `attributes` is True.
+
+        Args:
+            value: A MarkingSpecificationType node.
+            attributes: If True, mark attributes instead of element and
+                text nodes.
+        """
+        if attributes:
+            self._global_attrs.add(value)
+        else:
+            self._global_nodes.add(value)
+
+    def addsubtree(self, root, value, attributes=False):
+        """Add `value` to every element and text node in the subtree of
+        `root` (`root` included), or to every attribute in it if
+        `attributes` is True.
+
+        Args:
+            root: An lxml Element of the document.
+            value: A MarkingSpecificationType node.
+            attributes: If True, mark attributes instead of element and
+                text nodes.
+        """
+        nid = self._ids[root]
+
+        if attributes:
+            self._subtree_attrs.setdefault(nid, set()).add(value)
+        else:
+            self._subtree_nodes.setdefault(nid, set()).add(value)
+
 
 def _get_marking_specifications(root):
     """Find all MarkingSpecificationType instances found inside
@@ -189,6 +340,25 @@ def _get_controlled_structure(spec):
     return structs[0]
 
 
+def _get_namespaces(control):
+    """Return the namespace prefix mappings in scope for the input
+    Controlled_Structure, for use in XPath evaluation.
+
+    Args:
+        control: A Controlled_Structure lxml Element object.
+    """
+    namespaces = control.nsmap
+
+    # Fixes empty namespace to prefix key->value pair when default namespace is
+    # used. Note that XPath does not have a notion of a default namespace.
+    # The empty prefix is therefore undefined for XPath and cannot be used in
+    # namespace prefix mappings.
+    if None in namespaces:
+        del namespaces[None]
+
+    return namespaces
+
+
 def _get_marked_nodeset(control):
     """Return the nodeset selected by the XPath defined by the input
     Controlled_Structure.
@@ -200,17 +370,89 @@ def _get_marked_nodeset(control):
         An iterable collection of lxml objects.
     """
     xpath = control.text
-    namespaces = control.nsmap
+    namespaces = _get_namespaces(control)
 
-    # Fixes empty namespace to prefix key->value pair when default namespace is
-    # used. Note that XPath does not have a notion of a default namespace.
-    # The empty prefix is therefore undefined for XPath and cannot be used in
-    # namespace prefix mappings. The xpath() call can still fail if an invalid
-    # xpath expression is provided.
-    if None in namespaces:
-        del namespaces[None]
+    # The xpath() call can still fail if an invalid xpath expression is
+    # provided.
+    try:
+        compiled = xml.compile_xpath(xpath, namespaces)
+    except etree.XPathSyntaxError:
+        # Evaluate it directly so the error raised is the same as before.
+        return control.xpath(xpath, namespaces=namespaces)
+
+    return compiled(control)
+
+
+def _resolve_paths(control, paths):
+    """Resolve the classified Controlled_Structure `control` by walking the
+    document tree.
+
+    Args:
+        control: A Controlled_Structure lxml Element object.
+        paths: The list of classifier.Path tuples for its XPath.
+
+    Returns:
+        A list of ``(path, elements, attrname)`` tuples, where `elements`
+        are the elements the location path of `path` selects and `attrname`
+        is the Clark notation attribute name for attribute paths. None if
+        any path cannot be resolved this way.
+    """
+    namespaces = _get_namespaces(control)
+    resolved = []
+
+    for path in paths:
+        if path.target in (classifier.TARGET_GLOBAL, classifier.TARGET_GLOBAL_ATTRS):
+            resolved.append((path, None, None))
+            continue
+
+        elements = classifier.walk(control, path, namespaces)
 
-    return control.xpath(xpath, namespaces=namespaces)
+        if elements is None:
+            return None
+
+        attrname = None
+
+        if path.target == classifier.TARGET_ATTRIBUTE:
+            attrname = classifier.qualify(path.name[0], path.name[1], namespaces)
+
+            if attrname is None:
+                return None
+
+        resolved.append((path, elements, attrname))
+
+    return resolved
+
+
+def _add_resolved(marked, resolved, spec):
+    """Add `spec` to the `marked` MarkingMap for the nodes selected by the
+    output of _resolve_paths().
+    """
+    for path, elements, attrname in resolved:
+        target = path.target
+
+        if target == classifier.TARGET_GLOBAL:
+            marked.addglobal(spec)
+        elif target == classifier.TARGET_GLOBAL_ATTRS:
+            marked.addglobal(spec, attributes=True)
+        elif target == classifier.TARGET_SUBTREE:
+            for element in elements:
+                marked.addsubtree(element, spec)
+        elif target == classifier.TARGET_SUBTREE_ATTRS:
+            for element in elements:
+                marked.addsubtree(element, spec, attributes=True)
+        elif target == classifier.TARGET_SELF:
+            marked.addall(elements, spec)
+        elif target == classifier.TARGET_TEXT:
+            for element in elements:
+                marked.addtext(element, spec)
+        elif target == classifier.TARGET_ALL_ATTRS:
+            for element in elements:
+                for name in element.attrib:
+                    marked.addattribute(element, name, spec)
+        else:
+            for element in elements:
+                if attrname in element.attrib:
+                    marked.addattribute(element, attrname, spec)
 
 
 def build(root, encoding=None):
@@ -221,10 +463,22 @@ def build(root, encoding=None):
     The element/attribute nodes are the keys and the set of
     MarkingSpecification Element objects are the values.
 
+    Controlled_Structures which the classifier module recognizes are
+    resolved by walking the document tree instead of being evaluated by
+    lxml. Global markings (e.g., ``//node() | //@*``) are recorded as
+    document-level markings and subtree markings (e.g.,
+    ``../../../descendant-or-self::node()``) are recorded once per subtree.
+    The number of Controlled_Structures of each shape is kept in the
+    MarkingMap `stats` Counter.
+
+    Args:
+        root: The root lxml Element of the document.
+        encoding: The encoding of the input document. This is not used.
+
     Returns:
         A stixmarx MarkingMap object.
     """
-    marked = MarkingMap(encoding)
+    marked = MarkingMap(root)
     specs = _get_marking_specifications(root)
 
     for spec in specs:
@@ -233,7 +487,19 @@ def build(root, encoding=None):
         if control is None:
             continue
 
-        nodeset = _get_marked_nodeset(control)
-        marked.addall(nodeset, spec)
+        paths = classifier.classify(control.text)
+        resolved = None
+
+        if paths is not None:
+            resolved = _resolve_paths(control, paths)
+
+        if resolved is None:
+            nodeset = _get_marked_nodeset(control)
+            marked.addall(nodeset, spec)
+            marked.stats[classifier.SHAPE_XPATH] += 1
+        else:
+            _add_resolved(marked, resolved, spec)
+            marked.stats[classifier.shape(paths)] += 1
 
+    LOG.debug("Controlled_Structure shapes: %s", dict(marked.stats))
     return marked
@@ -2,17 +2,25 @@
 # See LICENSE.txt for complete terms.
 
 # stdlib
+import contextlib
 import logging
+import re
+import threading
+import weakref
+
+# external
+from lxml import etree
 
 # mixbox
 from mixbox import signals
 
 # python-stix
 from stix.core import STIXPackage
-from stix.data_marking import MarkingSpecification
+from stix.data_marking import Marking, MarkingSpecification
 
 # stixmarx
 from stixmarx import api
+from stixmarx import errors
 from stixmarx import xml
 from stixmarx import attrmap
 from stixmarx import markingmap
@@ -29,6 +37,72 @@ LOG = logging.getLogger(__name__)
 _ATTR_SOURCENODE = "__sourcenode__"
 _ATTR_BINDING = "__binding__"
 _NSMAP = {"marking": "http://data-marking.mitre.org/Marking-1"}
+_SIGNAL_ENTITY_CREATED = "Entity.created.from_obj"
+_TAG_STIX_HEADER = "STIX_Header"
+
+# Controlled_Structure XPath tokens which depend on siblings that are not
+# kept while streaming.
+_SIBLING_TOKENS = (
+    "last()",
+    "position()",
+    "preceding::",
+    "preceding-sibling::",
+    "following::",
+    "following-sibling::",
+)
+
+# Maps the localname of each STIX_Package collection element to the localname
+# of the top-level objects it contains and the STIXPackage attribute which
+# holds them once parsed.
+_TLO_COLLECTIONS = {
+    "Observables": ("Observable", "observables"),
+    "Indicators": ("Indicator", "indicators"),
+    "TTPs": ("TTP", "ttps"),
+    "Exploit_Targets": ("Exploit_Target", "exploit_targets"),
+    "Incidents": ("Incident", "incidents"),
+    "Courses_Of_Action": ("Course_Of_Action", "courses_of_action"),
+    "Campaigns": ("Campaign", "campaigns"),
+    "Threat_Actors": ("Threat_Actor", "threat_actors"),
+    "Reports": ("Report", "reports"),
+}
+
+# A STIX_Package collection step, optionally prefixed and indexed (e.g.,
+# "stix:Observables[1]/").
+_COLLECTION_STEP = r"(?<![\w.-])(?:[\w.-]+:)?(?P<collection>{0})(?:\[\s*\d+\s*\])?/".format(
+    "|".join(_TLO_COLLECTIONS)
+)
+_RE_COLLECTION_STEP = re.compile(_COLLECTION_STEP)
+
+# A collection step followed by a step which selects one of its children by
+# position (e.g., "stix:Observables[1]/cybox:Observable[2]" or
+# "stix:TTPs/*[3]").
+_RE_TLO_STEP = re.compile(
+    _COLLECTION_STEP +
+    r"(?:(?:[\w.-]+:)?(?P<name>[\w.-]+)|\*)\[\s*(?P<position>\d+)\s*\]"
+)
+
+# Joins the members of an XPath union.
+_UNION_SEPARATOR = xml.XPATH_JOIN_OPERATOR.format("", "")
+
+# MarkingSpecification interning modes.
+INTERN_DOCUMENT = "document"
+INTERN_PROCESS = "process"
+_INTERNING_MODES = (None, INTERN_DOCUMENT, INTERN_PROCESS)
+
+# MarkingSpecification objects shared by every parser which interns per
+# process, keyed by the canonical form of their Marking element, and the
+# lock which guards them.
+_INTERNED = weakref.WeakValueDictionary()
+_INTERNED_LOCK = threading.Lock()
+
+# Parse sessions which are currently receiving mixbox signals, per thread.
+_SESSIONS = threading.local()
+
+# Number of active parse sessions across all threads and the lock which
+# guards it. The mixbox signal receiver is connected only while at least one
+# session is active.
+_SESSION_COUNT = 0
+_SESSION_LOCK = threading.Lock()
 
 
 def _binding(entity):
@@ -60,6 +134,98 @@ def _sourcenode(entity):
         return None
 
 
+def _canonical_key(node):
+    """Return the exclusive canonical XML (C14N) serialization of the
+    MarkingSpecificationType `node`.
+
+    Prefixes used in xsi:type values are kept, since exclusive C14N would
+    otherwise drop the declarations they refer to.
+
+    Args:
+        node: A MarkingSpecificationType lxml Element.
+    """
+    prefixes = set()
+
+    for child in node.iter(etree.Element):
+        xsi_type = child.get(xml.TAG_XSI_TYPE)
+
+        if xsi_type and ":" in xsi_type:
+            prefixes.add(xsi_type.split(":")[0])
+
+    return etree.tostring(
+        node,
+        method="c14n",
+        exclusive=True,
+        with_comments=False,
+        inclusive_ns_prefixes=sorted(prefixes) or None
+    )
+
+
+def _active_sessions():
+    """Return the stack of MarkingParser objects that are parsing on the
+    current thread.
+    """
+    try:
+        return _SESSIONS.stack
+    except AttributeError:
+        _SESSIONS.stack = []
+        return _SESSIONS.stack
+
+
+def _dispatch_entity_created(entity, binding):
+    """Receiver for the mixbox Entity.created.from_obj signal.
+
+    Route the `entity` to the innermost MarkingParser that is parsing on the
+    current thread. Entities created outside of a parse session (or on a
+    thread that has no active session) are ignored.
+
+    Args:
+        entity: A mixbox Entity object.
+        binding: The generated binding object that the `entity` was
+            created from.
+    """
+    sessions = _active_sessions()
+
+    if sessions:
+        sessions[-1]._handle_entity_created(entity, binding)
+
+
+@contextlib.contextmanager
+def _session(parser):
+    """Context manager which routes mixbox Entity.created.from_obj signals
+    emitted on the current thread to `parser` for the duration of the block.
+
+    The module-level signal receiver is connected when the first session
+    starts and disconnected when the last one ends, so no receiver (or
+    parser) is left registered with mixbox between parses.
+
+    Args:
+        parser: A MarkingParser object.
+    """
+    global _SESSION_COUNT
+
+    with _SESSION_LOCK:
+        if _SESSION_COUNT == 0:
+            signals.connect(_SIGNAL_ENTITY_CREATED, _dispatch_entity_created)
+        _SESSION_COUNT += 1
+
+    sessions = _active_sessions()
+    sessions.append(parser)
+
+    try:
+        yield parser
+    finally:
+        sessions.pop()
+
+        with _SESSION_LOCK:
+            _SESSION_COUNT -= 1
+            if _SESSION_COUNT == 0:
+                signals.disconnect(
+                    _SIGNAL_ENTITY_CREATED,
+                    _dispatch_entity_created
+                )
+
+
 class MarkingParser(object):
     """Parses STIX XML documents and decorates STIXPackage objects with
     field-level markings.
@@ -71,19 +237,53 @@ class MarkingParser(object):
             in the input document with the Marking elements which mark them.
         _entities: A list of mixbox Entity objects that were created during
             parse().
+        _fieldindex: A dictionary which maps ``(element, field selector)``
+            tuples to the XML nodes they select. This is only populated while
+            markings are being processed.
+        _lazy: If True, parse() does not attach marking information. Each
+            entity is resolved on demand through resolve().
+        _pending: A dictionary which maps the ids of parsed entities to the
+            entities whose markings have not been resolved yet (lazy only).
+        _specmap: A mapping of lxml MarkingSpecificationType instance nodes
+            to their python-stix MarkingSpecification objects, kept while
+            entities are pending (lazy only).
+        _interning: None, INTERN_DOCUMENT or INTERN_PROCESS. If set, equal
+            Marking elements are parsed into one shared MarkingSpecification
+            object per document or per process.
+
+    Note:
+        A MarkingParser only receives mixbox signals while parse() is
+        running, and only those emitted on the thread that called parse().
+
+    Note:
+        Interned MarkingSpecification objects are shared by every object
+        they mark and, with INTERN_PROCESS, by every package parsed in the
+        process. Modifying one modifies it everywhere.
     """
 
-    def __init__(self, root, encoding=None):
+    def __init__(self, root, encoding=None, lazy=False, interning=None):
+        if interning not in _INTERNING_MODES:
+            error = "Unknown interning mode '{0}'.".format(interning)
+            raise errors.InvalidModeError(
+                message=error,
+                found=interning,
+                expected=_INTERNING_MODES
+            )
+
+        self._interning = interning
         self._encoding = encoding
         self._root = xml.root(root, encoding)
         self._markingmap = markingmap.build(self._root, encoding)
         self._entities = list()
-
-        # Connect our mixbox signal receiver
-        signals.connect("Entity.created.from_obj", self._handle_entity_created)
+        self._fieldindex = None
+        self._lazy = lazy
+        self._pending = {}
+        self._specmap = None
+        self._replaced = {}
 
     def _handle_entity_created(self, entity, binding):
-        """Receiver for the mixbox Entity.created.from_obj signal.
+        """Handle a mixbox Entity.created.from_obj signal routed to this
+        parser by _dispatch_entity_created().
 
         Attach the `binding` object to `entity` via a __binding__ attribute
         and then store `entity` in the _entities list for later processing.
@@ -102,6 +302,27 @@ class MarkingParser(object):
         entity.__binding__ = binding
         self._entities.append(entity)
 
+    def _find_field_nodes(self, node, xmlfield):
+        """Return the XML nodes under `node` selected by the `xmlfield`
+        selector, in document order.
+
+        Nodes are looked up in the field index built by _process_markings().
+        Namespace-qualified attribute selectors, which are not indexed, are
+        resolved directly against `node`.
+
+        Args:
+            node: An lxml Element which an Entity was parsed from.
+            xmlfield: An XML field selector from the attrmap module.
+
+        Returns:
+            A list of lxml nodes. The list is empty if nothing is selected.
+        """
+        if attrmap.is_attribute(xmlfield) and ":" in xmlfield:
+            found = xml.findattr(node, xmlfield)
+            return [] if found is None else [found]
+
+        return self._fieldindex.get((node, xmlfield), [])
+
     def _set_list_field_marking(self, entity, attr, specs):
         """Attach marking information to each item in the list found in the
         input ``entity.attr``.
@@ -109,6 +330,12 @@ class MarkingParser(object):
         This will also cast each value in list to a "markable" type which
         subclasses the original type. This is done via the stixmarx.types module.
 
+        Values are aligned with the XML nodes they were parsed from by
+        position, so each value only receives the markings of its own node.
+        If the values cannot be aligned with the nodes (e.g., several
+        delimiter-separated values parsed from a single text node), every
+        value receives the markings of every marked node.
+
         Note:
             Unmarked items in the list will not be altered in any way.
 
@@ -127,16 +354,41 @@ class MarkingParser(object):
         valuelist = getattr(entity, attr)
         node = _sourcenode(entity)
         xmlfield = attrmap.xmlfield(entity, attr)
-        xmlnodes = xml.findall(node, xmlfield)
-        marked = [x for x in xmlnodes if x in self._markingmap]
+        xmlnodes = self._find_field_nodes(node, xmlfield)
 
-        for idx, val in enumerate(valuelist):
-            for xmlnode in marked:
+        if len(xmlnodes) == len(valuelist):
+            pairs = zip(range(len(valuelist)), xmlnodes)
+        elif len(xmlnodes) == 1:
+            pairs = ((idx, xmlnodes[0]) for idx in range(len(valuelist)))
+        else:
+            pairs = None
+
+        if pairs is not None:
+            for idx, xmlnode in pairs:
+                found = self._markingmap.get(xmlnode)
+
+                if found is None:
+                    continue
+
+                markings = (specs[x] for x in found)
                 value = valuelist[idx]
-                markings = (specs[x] for x in self._markingmap[xmlnode])
+                valuelist[idx] = api.add_markings(value, markings)
+                self._record_replacement(value, valuelist[idx])
+            return
+
+        # The values could not be aligned with their nodes.
+        found = set()
+        for xmlnode in xmlnodes:
+            found.update(self._markingmap.get(xmlnode, ()))
 
-                markable = api.add_markings(value, markings)
-                valuelist[idx] = markable  # Replace the value in the list
+        if not found:
+            return
+
+        markings = [specs[x] for x in found]
+
+        for idx, value in enumerate(valuelist):
+            valuelist[idx] = api.add_markings(value, markings)
+            self._record_replacement(value, valuelist[idx])
 
     def _set_field_marking(self, entity, attr, specs):
         """Convert the `attr` attribute on `entity` to a markable type,
@@ -155,23 +407,40 @@ class MarkingParser(object):
         """
         node = _sourcenode(entity)
         xmlfield = attrmap.xmlfield(entity, attr)
+        xmlnode = next(iter(self._find_field_nodes(node, xmlfield)), None)
 
-        if attrmap.is_attribute(xmlfield):
-            xmlnode = xml.findattr(node, xmlfield)
-        elif attrmap.is_content(xmlfield):
-            xmlnode = xml.findtext(node)
-        else:
-            xmlnode = xml.find(node, xmlfield)
+        found = self._markingmap.get(xmlnode)
 
         # If the node was not marked, do not perform any conversion or replacement.
-        if xmlnode not in self._markingmap:
+        if found is None:
             return
 
         value = getattr(entity, attr)
-        markings = (specs[x] for x in self._markingmap[xmlnode])
+        markings = (specs[x] for x in found)
 
         markable = api.add_markings(value, markings)
         setattr(entity, attr, markable)
+        self._record_replacement(value, markable)
+
+    def _record_replacement(self, value, markable):
+        """Record that `markable` replaced `value` while resolving a lazily
+        parsed entity, so a `value` read before the entity was resolved can
+        still be queried. A value replaced at several places is ambiguous
+        and is recorded without a replacement.
+
+        Args:
+            value: The original field value.
+            markable: The marked value which replaced `value`.
+        """
+        if not self._lazy or markable is value:
+            return
+
+        key = id(value)
+
+        if key in self._replaced:
+            self._replaced[key] = (value, None)
+        else:
+            self._replaced[key] = (value, markable)
 
     def _process_attrs(self, entity, specs):
         """Attach marking information to all all non-Entity fields on `entity`
@@ -212,12 +481,12 @@ class MarkingParser(object):
                 nodes to their corresponding python-stix MarkingSpecification
                 objects.
         """
-        node = _sourcenode(entity)
+        found = self._markingmap.get(_sourcenode(entity))
 
-        if node not in self._markingmap:
+        if found is None:
             return
 
-        markings = (specs[x] for x in self._markingmap[node])
+        markings = (specs[x] for x in found)
         api.add_markings(entity, markings)
 
     def _get_marking_specification_nodemap(self):
@@ -237,8 +506,57 @@ class MarkingParser(object):
             source = _sourcenode(entity)  # TODO (bworrell): check for None?
             specmap[source] = entity
 
+        if self._interning is not None:
+            self._intern(specmap)
+
         return specmap
 
+    def _intern(self, specmap):
+        """Replace the MarkingSpecification values of `specmap` with one
+        shared object for each group of equal Marking elements. The
+        replaced objects are also replaced in the parsed Handling (Marking)
+        objects which contained them.
+
+        Marking elements are equal if their canonical XML forms are equal.
+        The first MarkingSpecification parsed for a canonical form is
+        kept, unless the parser interns per process and an equal one was
+        already parsed by another parser.
+
+        Args:
+            specmap: The dictionary built by
+                _get_marking_specification_nodemap().
+        """
+        replaced = {}
+        table = {}
+        nodes = (_sourcenode(x) for x in self._entities
+                 if isinstance(x, MarkingSpecification))
+
+        for node in nodes:
+            spec = specmap[node]
+            key = _canonical_key(node)
+
+            if self._interning == INTERN_PROCESS:
+                with _INTERNED_LOCK:
+                    canonical = _INTERNED.setdefault(key, spec)
+            else:
+                canonical = table.setdefault(key, spec)
+
+            if canonical is not spec:
+                specmap[node] = canonical
+                replaced[id(spec)] = canonical
+
+        if not replaced:
+            return
+
+        handlings = (x for x in self._entities if isinstance(x, Marking))
+
+        for handling in handlings:
+            for idx, spec in enumerate(handling.marking):
+                canonical = replaced.get(id(spec))
+
+                if canonical is not None:
+                    handling.marking[idx] = canonical
+
     def _cleanup(self, entity):
         """Remove the __binding__ attribute we attached to the entity during
         parse. This will help reduce the memory footprint.
@@ -261,27 +579,93 @@ class MarkingParser(object):
             attributes will be attached to it.
         """
         specmap = self._get_marking_specification_nodemap()
+        self._fieldindex = xml.index_fields(self._root)
+
+        if self._lazy:
+            self._specmap = specmap
+            self._pending = dict((id(x), x) for x in self._entities)
+            return
 
         for entity in self._entities:
             self._process_entity(entity, specmap)
             self._process_attrs(entity, specmap)
             self._cleanup(entity)
 
+        self._fieldindex = None
+
+    def _release(self):
+        """Drop the references to the source document once every parsed
+        entity has been resolved.
+        """
+        self._pending = {}
+        self._specmap = None
+        self._fieldindex = None
+        self._markingmap = None
+        self._root = None
+
+    @property
+    def replaced(self):
+        """Dictionary mapping the ids of field values replaced by marked
+        copies during a lazy resolution to (value, copy) tuples. The copy is
+        None if the value was replaced at several places.
+        """
+        return self._replaced
+
+    @property
+    def resolved(self):
+        """True if no parsed entity is waiting for its markings to be
+        resolved.
+        """
+        return not self._pending
+
+    def resolve(self, entity):
+        """Attach marking information to `entity` and its non-Entity fields
+        if `entity` was parsed lazily and has not been resolved yet.
+        Otherwise, do nothing.
+
+        Args:
+            entity: A mixbox Entity object (or any other object, which is
+                ignored).
+        """
+        entity = self._pending.pop(id(entity), None)
+
+        if entity is None:
+            return
+
+        self._process_entity(entity, self._specmap)
+        self._process_attrs(entity, self._specmap)
+        self._cleanup(entity)
+
+        if not self._pending:
+            self._release()
+
+    def resolve_all(self):
+        """Attach marking information to every parsed entity which has not
+        been resolved yet.
+        """
+        for entity in list(self._pending.values()):
+            self.resolve(entity)
+
     def parse(self):
         """Parse a STIX document and evaluate data markings found in the
         document. All marked fields will have marking information attached
         and can be queried via MarkingContainer interfaces.
 
+        If the parser is lazy, marking information is attached to each
+        entity (and its non-Entity fields) when resolve() is called for it.
+
         Returns:
             A STIXPackage object.
         """
         self._entities = list()  # Reset this in case of multiple parse() calls.
 
-        # Parse the STIX Package.
-        package = STIXPackage.from_xml(
-            xml_file=self._root,
-            encoding=self._encoding
-        )
+        # Parse the STIX Package, collecting the entities created on this
+        # thread while doing so.
+        with _session(self):
+            package = STIXPackage.from_xml(
+                xml_file=self._root,
+                encoding=self._encoding
+            )
 
         # Attach marking information to all marked fields.
         self._process_markings()
@@ -290,6 +674,337 @@ class MarkingParser(object):
         return package
 
 
-def parse_xml(xml_input, encoding=None):
-    parser = MarkingParser(root=xml_input, encoding=encoding)
+def parse_xml(xml_input, encoding=None, interning=None):
+    parser = MarkingParser(
+        root=xml_input,
+        encoding=encoding,
+        interning=interning
+    )
     return parser.parse()
+
+
+def _split_union(path):
+    """Return the members of the top-level union of the XPath `path`."""
+    members = []
+    depth = 0
+    quote = None
+    start = 0
+
+    for idx, char in enumerate(path):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in "'\"":
+            quote = char
+        elif char in "[(":
+            depth += 1
+        elif char in "])":
+            depth -= 1
+        elif char == "|" and depth == 0:
+            members.append(path[start:idx].strip())
+            start = idx + 1
+
+    members.append(path[start:].strip())
+    return members
+
+
+def _tlo_key(member):
+    """Return the ``(collection, name, position)`` key of the top-level
+    object which the XPath union `member` selects by position, and
+    `member` rewritten to select the first object of the collection
+    instead. The name is None for a wildcard step.
+
+    Returns:
+        A ``(key, member)`` tuple. The key is None if `member` does not
+        select exactly one top-level object by position.
+    """
+    found = list(_RE_TLO_STEP.finditer(member))
+
+    if len(found) != 1:
+        return None, member
+
+    match = found[0]
+    key = (match.group("collection"), match.group("name"), int(match.group("position")))
+    member = member[:match.start("position")] + "1" + member[match.end("position"):]
+
+    return key, member
+
+
+class _StreamHeader(object):
+    """The STIX_Header of a streamed document, with its markings grouped by
+    the top-level object that their Controlled_Structures select.
+
+    Controlled_Structures are split into the members of their union once,
+    when the STIX_Header is read. A member which selects a top-level object
+    by its position in its collection (e.g.,
+    ``stix:Observables[1]/cybox:Observable[2]``) only applies to that
+    object, and is rewritten to select the first object of the collection,
+    which is where _parse_tlo() places it. Other members apply to every
+    top-level object.
+
+    The Marking elements are detached from the STIX_Header and only the
+    ones which apply to a top-level object are attached while it is parsed.
+
+    Args:
+        header: The STIX_Header lxml element.
+
+    Raises:
+        UnrecognizedMarkingPathError: If a Controlled_Structure depends on
+            the siblings of a top-level object (e.g., ``last()``).
+    """
+
+    def __init__(self, header):
+        self.element = header
+
+        # (parent, marking, control, general members, keyed members) tuples,
+        # in document order.
+        self._markings = []
+
+        # Indexes of the markings with general members, and of the markings
+        # with members keyed by each top-level object.
+        self._general = []
+        self._keyed = {}
+
+        markings = header.iterfind(".//marking:Marking", namespaces=_NSMAP)
+
+        for idx, marking in enumerate(list(markings)):
+            parent = marking.getparent()
+            parent.remove(marking)
+
+            control = marking.find("marking:Controlled_Structure", namespaces=_NSMAP)
+            general = []
+            keyed = {}
+
+            if control is None or not control.text:
+                self._general.append(idx)
+                self._markings.append((parent, marking, control, general, keyed))
+                continue
+
+            for member in _split_union(control.text):
+                self._check(member)
+                key, rewritten = _tlo_key(member)
+
+                if key is None:
+                    general.append(member)
+                else:
+                    keyed.setdefault(key, []).append(rewritten)
+
+            if general:
+                self._general.append(idx)
+
+            for key in keyed:
+                self._keyed.setdefault(key, []).append(idx)
+
+            self._markings.append((parent, marking, control, general, keyed))
+
+    @staticmethod
+    def _check(member):
+        if not _RE_COLLECTION_STEP.search(member):
+            return
+
+        if any(x in member for x in _SIBLING_TOKENS):
+            error = "Cannot stream the Controlled_Structure '{0}'.".format(member)
+            raise errors.UnrecognizedMarkingPathError(
+                message=error,
+                entity=None,
+                path=member
+            )
+
+    def attach(self, keys):
+        """Attach the markings which apply to the top-level object selected
+        by any of `keys`, with Controlled_Structures which select it as the
+        first object of its collection.
+
+        Returns:
+            A list of ``(marking, control, text)`` tuples, where `text` is
+            the original Controlled_Structure, for restore() and detach().
+        """
+        indexes = set(self._general)
+
+        for key in keys:
+            indexes.update(self._keyed.get(key, ()))
+
+        attached = []
+
+        for idx in sorted(indexes):
+            parent, marking, control, general, keyed = self._markings[idx]
+            attached.append((marking, control, control is not None and control.text))
+
+            if keyed:
+                members = list(general)
+
+                for key in keys:
+                    members.extend(keyed.get(key, ()))
+
+                control.text = _UNION_SEPARATOR.join(members)
+
+            parent.append(marking)
+
+        return attached
+
+    @staticmethod
+    def restore(attached):
+        """Restore the original Controlled_Structures of the `attached`
+        markings.
+        """
+        for _, control, text in attached:
+            if control is not None:
+                control.text = text
+
+    @staticmethod
+    def detach(attached):
+        """Detach the `attached` markings from the STIX_Header."""
+        for marking, _, _ in attached:
+            marking.getparent().remove(marking)
+
+
+def _parse_tlo(root, header, node, package_tags, keys, encoding=None):
+    """Parse the top-level object `node` on its own and return it with its
+    markings resolved.
+
+    `node` is moved into a new document which contains a copy of the
+    STIX_Package `root` element, the STIX_Header and a copy of the
+    collection element `node` was found in, where it is the first child.
+    Only the STIX_Header markings which apply to `node` are attached to the
+    STIX_Header while the marking map is built (see _StreamHeader).
+    Controlled_Structure XPaths in `node` and in the STIX_Header are
+    therefore evaluated just as they would be in the full document, limited
+    to this one top-level object.
+
+    Empty placeholder elements stand in for the other children of the
+    STIX_Package while the XPaths are evaluated. They are removed before
+    the document is parsed.
+
+    Args:
+        root: The STIX_Package lxml element being streamed.
+        header: A _StreamHeader or None.
+        node: A top-level object lxml element.
+        package_tags: The tags of the STIX_Package children which precede
+            the collection of `node`, with None in place of the STIX_Header.
+        keys: The ``(collection, name, position)`` keys which select `node`
+            in the original document.
+        encoding: The encoding of the input document.
+
+    Returns:
+        A python-stix (or python-cybox) top-level object.
+    """
+    collection = node.getparent()
+    _, attr = _TLO_COLLECTIONS[xml.localname(collection)]
+
+    doc = xml.copy_element(root)
+    placeholders = []
+
+    for tag in package_tags:
+        if tag is None:
+            doc.append(header.element)
+        else:
+            placeholders.append(etree.SubElement(doc, tag))
+
+    wrapper = xml.copy_element(collection)
+    doc.append(wrapper)
+    wrapper.append(node)
+
+    attached = header.attach(keys) if header is not None else []
+
+    try:
+        # The marking map is built when the parser is created.
+        parser = MarkingParser(doc, encoding)
+    finally:
+        _StreamHeader.restore(attached)
+
+    for placeholder in placeholders:
+        placeholder.getparent().remove(placeholder)
+
+    try:
+        package = parser.parse()
+    finally:
+        _StreamHeader.detach(attached)
+
+    return next(iter(getattr(package, attr)))
+
+
+def iterparse_xml(xml_input, encoding=None):
+    """Incrementally parse a STIX document, one top-level object at a time.
+
+    Each top-level object (Indicator, Observable, TTP, Incident, etc.) is
+    parsed as soon as its closing tag is read, yielded with its markings
+    attached, and removed from the document. Markings found in the
+    STIX_Header apply to every top-level object, so memory use is bounded
+    by the size of the STIX_Header and the largest top-level object rather
+    than by the size of the document.
+
+    Note:
+        The STIX_Header must appear before any top-level object. Only
+        top-level objects are yielded; other STIX_Package content (e.g.,
+        the STIX_Header, TTPs/Kill_Chains or Related_Packages) is
+        discarded. Controlled_Structure XPaths are evaluated against the
+        STIX_Header and the current top-level object only. STIX_Header
+        XPaths which select a top-level object by position (e.g.,
+        ``stix:Observables[1]/cybox:Observable[2]``) are grouped by
+        position once and only evaluated for that object.
+
+    Args:
+        xml_input: A filename or read()-able XML document.
+        encoding: The encoding of the input document.
+
+    Yields:
+        Top-level objects whose marking information can be queried via the
+        stixmarx.api module.
+
+    Raises:
+        UnrecognizedMarkingPathError: If a STIX_Header Controlled_Structure
+            depends on the siblings of a top-level object (e.g., ``last()``
+            or the ``following-sibling`` axis).
+    """
+    root = None
+    header = None
+    package_tags = []
+    collection = None
+    counts = {}
+    depth = 0
+
+    for event, node in xml.iterparse(xml_input, encoding):
+        if event == "start":
+            if root is None:
+                root = node
+            depth += 1
+            continue
+
+        depth -= 1
+
+        if depth == 1:
+            # A direct child of the STIX_Package has been read.
+            if xml.localname(node) == _TAG_STIX_HEADER:
+                header = _StreamHeader(node)
+                package_tags.append(None)
+            else:
+                package_tags.append(node.tag)
+                node.clear()
+            continue
+
+        if depth != 2:
+            continue
+
+        parent = node.getparent()
+        name = xml.localname(node)
+
+        if parent is not collection:
+            collection = parent
+            counts = {}
+
+        # Positions among the siblings with the same name and among all
+        # siblings.
+        counts[name] = counts.get(name, 0) + 1
+        counts[None] = counts.get(None, 0) + 1
+
+        found = _TLO_COLLECTIONS.get(xml.localname(parent))
+
+        if found is None or found[0] != name:
+            continue
+
+        keys = (
+            (xml.localname(parent), name, counts[name]),
+            (xml.localname(parent), None, counts[None]),
+        )
+
+        yield _parse_tlo(root, header, node, package_tags, keys, encoding)
@@ -2,11 +2,14 @@
 # See LICENSE.txt for complete terms.
 
 # builtins
+import collections
 import copy
+import itertools
 import logging
 
 # external
-from mixbox.vendor.six import iteritems
+from lxml import etree
+from mixbox.vendor.six import iteritems, itervalues
 
 # internal
 from stixmarx import attrmap
@@ -18,6 +21,37 @@ from stixmarx import xml
 # Module-level logger
 LOG = logging.getLogger(__name__)
 
+# Joins the members of an XPath union.
+_UNION_SEPARATOR = xml.XPATH_JOIN_OPERATOR.format("", "")
+
+# STIXPackage top-level object collection attributes, in document order.
+# They follow the STIX_Header and precede any other STIX_Package children.
+_TLO_COLLECTIONS = (
+    "observables",
+    "indicators",
+    "ttps",
+    "exploit_targets",
+    "incidents",
+    "courses_of_action",
+    "campaigns",
+    "threat_actors",
+    "reports",
+)
+
+_TAG_STIX_HEADER = "STIX_Header"
+
+
+def _clone_marking(marking):
+    """Return a shallow copy of the MarkingSpecification `marking`.
+
+    The copy has its own field dictionary, so its controlled_structure can be
+    set without changing `marking`. Every field value (marking structures,
+    information source, etc.) is shared with `marking`.
+    """
+    clone = copy.copy(marking)
+    clone._fields = dict(marking._fields)
+    return clone
+
 
 class MarkingSerializer(object):
     """Enables the serialization of markable content by creating XPath
@@ -34,11 +68,95 @@ class MarkingSerializer(object):
         container: A MarkingContainer object.
         nsmap: A dictionary with the namespace to prefix map of STIX, CybOX and
             MAEC.
+        coalesce: If True, the XPaths of the fields which one marking is
+            applied to are joined into one union controlled structure per
+            Handling, instead of one Marking per field.
+        max_xpath_length: The maximum length of a joined controlled
+            structure, or None for no limit.
 
     """
-    def __init__(self, marking_container):
+    def __init__(self, marking_container, coalesce=False,
+                 max_xpath_length=None):
         self._container = marking_container
         self._nsmap = utils.load_nsmap()
+        self._coalesce = coalesce
+        self._max_xpath_length = max_xpath_length
+
+        # Maps the ids of marked fields to (ancestors, field name, field)
+        # tuples. Filled by _index_paths().
+        self._paths = {}
+
+        # Maps parent ids to (parent, positions) tuples, where positions maps
+        # child ids to (attribute name, 1-based position) tuples. Filled by
+        # _get_positions().
+        self._positions = {}
+
+    def _get_positions(self, parent):
+        """Return the positions of the children of `parent`, indexing them
+        on first use.
+
+        Children are looked up by identity. A child found in several fields
+        (or several times in one sequence) keeps its first position.
+
+        Returns:
+            A dictionary which maps child ids to (attribute name, position)
+            tuples. The attribute name is None for an item of a sequence
+            `parent` which is not also in one of its fields. The position of
+            a child which is not in a sequence is 1.
+        """
+        cached = self._positions.get(id(parent))
+
+        if cached is not None and cached[0] is parent:
+            return cached[1]
+
+        positions = {}
+
+        if utils.is_sequence(parent):
+            for idx, item in enumerate(parent, start=1):
+                positions.setdefault(id(item), (None, idx))
+
+        if hasattr(parent, "typed_fields_with_attrnames"):
+            for properties in parent.typed_fields_with_attrnames():
+                attr = properties[0]
+                val = getattr(parent, attr)
+
+                items = enumerate(val, start=1) if utils.is_sequence(val) else ((1, val),)
+
+                for idx, item in items:
+                    found = positions.get(id(item))
+
+                    if found is None:
+                        positions[id(item)] = (attr, idx)
+                    elif found[0] is None:
+                        # An item of a sequence `parent` keeps its position.
+                        positions[id(item)] = (attr, found[1])
+
+        self._positions[id(parent)] = (parent, positions)
+        return positions
+
+    def _index_paths(self, fields):
+        """Record the ancestors and field name of each object in `fields`
+        with one walk of the package.
+
+        Args:
+            fields: An iterable of `markable` entities.
+        """
+        wanted = set(id(x) for x in fields) - set(self._paths)
+
+        if not wanted:
+            return
+
+        for ancestors, field_name, field_value in navigator.iterpath(self._container.package):
+            key = id(field_value)
+
+            if key not in wanted:
+                continue
+
+            self._paths[key] = (list(ancestors), field_name, field_value)
+            wanted.discard(key)
+
+            if not wanted:
+                break
 
     def _apply_global_markings(self):
         package = self._container.package
@@ -50,7 +168,7 @@ class MarkingSerializer(object):
         handling = utils.get_handling(package)
 
         for marking in global_markings:
-            marking = copy.deepcopy(marking)
+            marking = _clone_marking(marking)
             marking.controlled_structure = xml.XPATH_GLOBAL_ALL_FIELDS
 
             handling.add_marking(marking)
@@ -65,7 +183,7 @@ class MarkingSerializer(object):
                 True/False value to indicate if marking applies to descendants.
         """
         for marking, descendants in marking_info:
-            marking = copy.deepcopy(marking)
+            marking = _clone_marking(marking)
             marking.controlled_structure, handling =\
                 self._find_path_and_handling(field, descendants)
 
@@ -77,9 +195,67 @@ class MarkingSerializer(object):
         if not field_markings:
             return
 
+        self._index_paths(field_markings)
+
+        if self._coalesce:
+            self._apply_coalesced_markings(field_markings)
+            return
+
         for field, markings_info in iteritems(field_markings):
             self._apply_markings_to_field(field, markings_info)
 
+    def _apply_coalesced_markings(self, field_markings):
+        """Apply each marking once per Handling, with a controlled structure
+        which joins the XPaths of all the fields it marks there.
+
+        Args:
+            field_markings: The MarkingContainer field markings collection.
+        """
+        groups = collections.OrderedDict()
+
+        for field, markings_info in iteritems(field_markings):
+            for marking, descendants in markings_info:
+                xpath, handling = self._find_path_and_handling(field, descendants)
+                key = (id(marking), id(handling))
+                group = groups.setdefault(key, (marking, handling, []))
+                group[2].append(xpath)
+
+        for marking, handling, xpaths in itervalues(groups):
+            for xpath in self._join_xpaths(xpaths):
+                clone = _clone_marking(marking)
+                clone.controlled_structure = xpath
+                handling.add_marking(clone)
+
+    def _join_xpaths(self, xpaths):
+        """Join `xpaths` into as few XPath unions as `max_xpath_length`
+        allows. An XPath which is longer than the limit on its own is
+        returned as is.
+
+        Returns:
+            A list of XPath strings.
+        """
+        limit = self._max_xpath_length
+        chunks = []
+        current = []
+        length = 0
+
+        for xpath in xpaths:
+            added = len(xpath) + (len(_UNION_SEPARATOR) if current else 0)
+
+            if current and limit is not None and length + added > limit:
+                chunks.append(current)
+                current = []
+                added = len(xpath)
+                length = 0
+
+            current.append(xpath)
+            length += added
+
+        if current:
+            chunks.append(current)
+
+        return [_UNION_SEPARATOR.join(x) for x in chunks]
+
     def _apply_null_markings(self):
         package = self._container.package
         null_markings = self._container._null_markings
@@ -90,7 +266,7 @@ class MarkingSerializer(object):
         handling = utils.get_handling(package)
 
         for marking in null_markings:
-            marking = copy.deepcopy(marking)
+            marking = _clone_marking(marking)
             handling.add_marking(marking)
 
     def _apply_markings(self):
@@ -132,6 +308,120 @@ class MarkingSerializer(object):
         self._apply_markings()
         return package.to_dict(*args, **kwargs)
 
+    def write_xml(self, fileobj, encoding="utf-8", **kwargs):
+        """Applies the MarkingSpecification objects from global_markings and
+        field makings from the MarkingContainer, then writes the package XML
+        to `fileobj` one top-level object at a time.
+
+        The package is serialized without its top-level objects first. Each
+        top-level object is then serialized on its own and written out
+        through an lxml ``xmlfile`` before the next one is serialized. Every
+        namespace used in the package is declared on the root element, so
+        the prefixes used by STIX_Header markings resolve.
+
+        Args:
+            fileobj: A file-like object with a write() method, or a filename.
+            encoding: The output encoding.
+            **kwargs: Keyword arguments from ``stix.Entity.to_xml()``, other
+                than `encoding`.
+        """
+        package = self._container.package
+        self._apply_markings()
+
+        namespaces = dict(kwargs.pop("ns_dict", None) or {})
+
+        for obj in itertools.chain((package,), navigator.iterwalk(package)):
+            namespace = getattr(obj, "_namespace", None)
+
+            if namespace in namespaces or namespace not in self._nsmap:
+                continue
+
+            namespaces[namespace] = self._nsmap.preferred_prefix_for_namespace(namespace)
+
+        kwargs["ns_dict"] = namespaces
+        kwargs["encoding"] = "utf-8"
+
+        tlo_collections = [
+            (attr, getattr(package, attr, None)) for attr in _TLO_COLLECTIONS
+        ]
+        tlo_collections = [x for x in tlo_collections if x[1]]
+
+        try:
+            for attr, _ in tlo_collections:
+                setattr(package, attr, None)
+
+            skeleton = etree.fromstring(package.to_xml(**kwargs))
+        finally:
+            for attr, collection in tlo_collections:
+                setattr(package, attr, collection)
+
+        # Top-level objects do not repeat the package schemaLocation.
+        kwargs["include_schemalocs"] = False
+
+        children = list(skeleton)
+        headers = [x for x in children if xml.localname(x) == _TAG_STIX_HEADER]
+
+        with etree.xmlfile(fileobj, encoding=encoding) as xf:
+            xf.write_declaration()
+
+            with xf.element(skeleton.tag, dict(skeleton.attrib), nsmap=skeleton.nsmap):
+                for child in headers:
+                    xf.write(child)
+
+                for _, collection in tlo_collections:
+                    self._write_collection(xf, collection, kwargs)
+
+                for child in children:
+                    if xml.localname(child) != _TAG_STIX_HEADER:
+                        xf.write(child)
+
+    def _write_collection(self, xf, collection, kwargs):
+        """Write the top-level object `collection` to the lxml ``xmlfile``
+        `xf`, serializing one of its items at a time.
+
+        The collection is first serialized with only its first item, which
+        gives the collection wrapper element and its other children (e.g.,
+        ``TTPs/Kill_Chains``) in document order. Every other item is then
+        serialized inside a new, otherwise empty collection of the same
+        type and written after the first one.
+        """
+        klass = type(collection)
+        field = klass._multiple_field()
+        items = iter(collection)
+        first = next(items, None)
+
+        if first is None:
+            return
+
+        def serialize(entity):
+            return etree.fromstring(entity.to_xml(**kwargs))
+
+        def is_item(node):
+            return xml.localname(node) == field.name
+
+        head = copy.copy(collection)
+        head._fields = dict(collection._fields)
+        setattr(head, field.attr_name, [first])
+
+        wrapper = serialize(head)
+        children = list(wrapper)
+        position = next(i for i, x in enumerate(children) if is_item(x))
+
+        with xf.element(wrapper.tag, dict(wrapper.attrib), nsmap=wrapper.nsmap):
+            for child in children[:position + 1]:
+                xf.write(child)
+
+            for item in items:
+                single = klass()
+                single.append(item)
+
+                for child in serialize(single):
+                    if is_item(child):
+                        xf.write(child)
+
+            for child in children[position + 1:]:
+                xf.write(child)
+
     def _find_path_and_handling(self, field, descendants):
         """Generates an XPath expression based on the field provided. It also
         resolves `Handling` to indicate where the marking will be stored.
@@ -150,67 +440,59 @@ class MarkingSerializer(object):
             SerializerFieldNotFoundError: When a field marking was not found
                 after walking the object model.
         """
-        handling = None
-        xpath = None
-        found = False
-
-        for entity_path in navigator.iterpath(self._container.package):
-            if field is entity_path[2]:
-                found = True
-                ancestors = entity_path[0]
-                field_name = entity_path[1]
-                field_value = entity_path[2]
-
-                ancestors, xpath, handling = self._resolve_handling(
-                        ancestors,
-                        field_value
-                )
+        self._index_paths([field])
+        entity_path = self._paths.get(id(field))
 
-                for entity in ancestors:
-                    index = ancestors.index(entity)
-                    prefix = self._nsmap.preferred_prefix_for_namespace(
-                            entity._namespace
-                    )
-
-                    mapping = self._map_to_xml(
-                            index,
-                            ancestors,
-                            descendants,
-                            field_name
-                    )
-
-                    predicate = self._resolve_xpath_predicate(
-                            index,
-                            ancestors,
-                            field_value
-                    )
-
-                    if (attrmap.is_attribute(mapping) or
-                            attrmap.is_content(mapping) or
-                            utils.is_node(mapping)):
-                        xpath.append(mapping)
-                    else:
-                        step = xml.XPATH_STRUCTURE.format(
-                                prefix=prefix,
-                                nodename=mapping,
-                                predicates=predicate
-                        )
-
-                        xpath.append(step)
-
-                index = len(ancestors) - 1
-                mapping = self._map_to_xml(index, ancestors, descendants)
-
-                if not (attrmap.is_attribute(xpath[-1]) or
-                        attrmap.is_content(xpath[-1])):
-                    xpath.append(mapping)
-                break
-
-        if not found:
+        if entity_path is None or entity_path[2] is not field:
             error = "Could not generate an XPath for {0}".format(field)
             raise errors.SerializerFieldNotFoundError(entity=field,
                                                       message=error)
 
+        ancestors, field_name, field_value = entity_path
+
+        ancestors, xpath, handling = self._resolve_handling(
+                ancestors,
+                field_value
+        )
+
+        for index, entity in enumerate(ancestors):
+            prefix = self._nsmap.preferred_prefix_for_namespace(
+                    entity._namespace
+            )
+
+            mapping = self._map_to_xml(
+                    index,
+                    ancestors,
+                    descendants,
+                    field_name
+            )
+
+            predicate = self._resolve_xpath_predicate(
+                    index,
+                    ancestors,
+                    field_value
+            )
+
+            if (attrmap.is_attribute(mapping) or
+                    attrmap.is_content(mapping) or
+                    utils.is_node(mapping)):
+                xpath.append(mapping)
+            else:
+                step = xml.XPATH_STRUCTURE.format(
+                        prefix=prefix,
+                        nodename=mapping,
+                        predicates=predicate
+                )
+
+                xpath.append(step)
+
+        index = len(ancestors) - 1
+        mapping = self._map_to_xml(index, ancestors, descendants)
+
+        if not (attrmap.is_attribute(xpath[-1]) or
+                attrmap.is_content(xpath[-1])):
+            xpath.append(mapping)
+
         xpath = xml.XPATH_SELECT_OPERATOR.join(xpath)
 
         if xml.XPATH_AXIS_DESCENDANT_OR_SELF_NODE in xpath and descendants:
@@ -256,16 +538,10 @@ class MarkingSerializer(object):
 
         elif path[index]._namespace in self._nsmap:
             result = None
+            position = self._get_positions(path[index]).get(id(path[index + 1]))
 
-            for properties in path[index].typed_fields_with_attrnames():
-                attr = properties[0]
-
-                val = getattr(path[index], attr)
-
-                if (val is path[index + 1] or
-                        (utils.is_sequence(val) and path[index + 1] in val)):
-                    result = attrmap.xmlfield(path[index], attr)
-                    break
+            if position is not None and position[0] is not None:
+                result = attrmap.xmlfield(path[index], position[0])
 
             if result is not None:
                 return result
@@ -356,21 +632,9 @@ class MarkingSerializer(object):
             int: By default 1 if the Entity is not a sequence or only one
                 instance exist. Otherwise the index + 1 offset.
         """
-        if utils.is_sequence(object_):
-            if to_find in object_:
-                return object_.index(to_find) + 1
-
-        for properties in object_.typed_fields_with_attrnames():
-            attr = properties[0]
-
-            val = getattr(object_, attr)
-
-            if utils.is_sequence(val) and to_find in val:
-                try:
-                    return val.index(to_find) + 1
-                except KeyError:
-                    for idx, value in enumerate(val, start=0):
-                        if value is to_find:
-                            return idx + 1
+        position = self._get_positions(object_).get(id(to_find))
+
+        if position is not None:
+            return position[1]
 
         return 1
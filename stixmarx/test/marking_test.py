@@ -17,6 +17,8 @@ from cybox.objects.address_object import Address
 # internal
 import stixmarx
 import stixmarx.errors as errors
+from stixmarx import api
+from stixmarx import utils
 
 STIX_XML_TEMPLATE_GLOBAL_AND_COMPONENT = """<stix:STIX_Package
     xmlns:cyboxCommon="http://cybox.mitre.org/common-2"
@@ -127,6 +129,155 @@ class MarkingTest(unittest.TestCase):
         
         self.assertTrue(container.is_marked(indicator, red_marking))
 
+    def test_get_marked_objects(self):
+        """Test that the objects a marking is attached to can be listed"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        indicator = Indicator(title="Test")
+        package.add_indicator(indicator)
+        observable = generate_observable()
+        package.add_observable(observable)
+
+        self.assertEqual(container.get_marked_objects(red_marking), [])
+
+        container.add_marking(indicator, red_marking, descendants=True)
+        container.add_marking(observable, red_marking)
+        marked = container.get_marked_objects(red_marking)
+
+        self.assertTrue(any(x is indicator for x in marked))
+        self.assertTrue(any(x is observable for x in marked))
+
+        container.remove_marking(observable, red_marking)
+        marked = container.get_marked_objects(red_marking)
+
+        self.assertFalse(any(x is observable for x in marked))
+
+        container.clear_markings(indicator, descendants=True)
+
+        self.assertEqual(container.get_marked_objects(red_marking), [])
+
+    def test_component_marking_scope(self):
+        """Test that component markings are not attached to descendants"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        incident = Incident(title="Test")
+        package.add_incident(incident)
+
+        indicator = Indicator(title="Test")
+        incident.related_indicators.append(indicator)
+
+        container.add_marking(incident, red_marking, descendants=True)
+
+        self.assertTrue(container.is_marked(indicator, red_marking))
+        self.assertFalse(red_marking in api.get_markings(indicator))
+
+        container.remove_marking(incident, red_marking, descendants=True)
+
+        self.assertFalse(container.is_marked(indicator, red_marking))
+
+    def test_component_marking_scope_after_flush(self):
+        """Test that a removed component marking no longer applies to
+        descendants once field markings have been flushed"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        incident = Incident(title="Test")
+        package.add_incident(incident)
+
+        indicator = Indicator(title="Test")
+        incident.related_indicators.append(indicator)
+
+        container.add_marking(incident, red_marking, descendants=True)
+        container.flush()
+
+        # The document now holds the marking, as a parsed document would.
+        incident.handling.add_marking(red_marking)
+        self.assertTrue(container.is_marked(indicator, red_marking))
+
+        container.remove_marking(incident, red_marking, descendants=True)
+
+        self.assertFalse(container.is_marked(indicator, red_marking))
+        self.assertFalse(container.is_marked(indicator.title, red_marking))
+
+    def test_component_marking_new_descendant(self):
+        """Test that component markings apply to descendants added later"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        incident = Incident(title="Test")
+        package.add_incident(incident)
+
+        indicator = Indicator(title="Test")
+        incident.related_indicators.append(indicator)
+
+        container.add_marking(incident, red_marking, descendants=True)
+        self.assertTrue(container.is_marked(indicator, red_marking))
+
+        observable = generate_observable()
+        indicator.add_observable(observable)
+
+        self.assertTrue(container.is_marked(observable, red_marking))
+        self.assertRaises(errors.MarkingRemovalError, container.remove_marking, observable, red_marking)
+
+    def test_add_markings_bulk(self):
+        """Test that markings can be added in bulk"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        amber_marking = generate_marking_spec(generate_amber_marking_struct())
+
+        indicator = Indicator(title="Test")
+        package.add_indicator(indicator)
+
+        results = container.add_markings_bulk([
+            (indicator, red_marking, True),
+            (indicator.title, amber_marking, False),
+            (None, amber_marking, False),
+        ])
+
+        self.assertTrue(results[0] is indicator)
+        self.assertEqual(results[1], "Test")
+        self.assertTrue(results[2] is None)
+
+        indicator.title = results[1]
+
+        self.assertTrue(container.is_marked(indicator.title, red_marking))
+        self.assertTrue(container.is_marked(indicator.title, amber_marking))
+        self.assertEqual(len(container.null_markings), 1)
+
+        self.assertRaises(
+            errors.DuplicateMarkingError,
+            container.add_markings_bulk,
+            [(indicator, red_marking, False)]
+        )
+
+    def test_component_marking_shared_value(self):
+        """Test that component markings do not reach an equal value held by
+            another entity"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        first = Indicator(title="Test")
+        second = Indicator(title="Test")
+        package.add_indicator(first)
+        package.add_indicator(second)
+
+        container.add_marking(first, red_marking, descendants=True)
+
+        self.assertFalse(container.is_marked(second.title, red_marking))
+
+        second.title = container.add_marking(second.title, red_marking)
+
+        self.assertTrue(container.is_marked(second.title, red_marking))
+        container.remove_marking(second.title, red_marking)
+
     def test_global_package_marking(self):
         """Test that global markings apply to the package and TLOs"""
         container = stixmarx.new()
@@ -192,6 +343,48 @@ class MarkingTest(unittest.TestCase):
         self.assertTrue(container.is_marked(indicator, red_marking))
         self.assertTrue(container.is_marked(indicator, amber_marking))
 
+    def test_effective_markings(self):
+        """Test that effective markings include component and global markings"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        amber_marking = generate_marking_spec(generate_amber_marking_struct())
+
+        incident = Incident(title="Test")
+        package.add_incident(incident)
+
+        indicator = Indicator(title="Test")
+        incident.related_indicators.append(indicator)
+
+        container.add_marking(incident, red_marking, descendants=True)
+        container.add_global(amber_marking)
+
+        effective = container.get_effective_markings(indicator)
+        self.assertTrue(red_marking in effective)
+        self.assertTrue(amber_marking in effective)
+
+        container.remove_marking(incident, red_marking, descendants=True)
+        effective = container.get_effective_markings(indicator)
+        self.assertFalse(red_marking in effective)
+        self.assertTrue(amber_marking in effective)
+
+    def test_effective_markings_field_only(self):
+        """Test that markings of an ancestor itself are not inherited"""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        incident = Incident(title="Test")
+        package.add_incident(incident)
+
+        indicator = Indicator(title="Test")
+        incident.related_indicators.append(indicator)
+
+        container.add_marking(incident, red_marking)
+
+        self.assertTrue(red_marking in container.get_effective_markings(incident))
+        self.assertFalse(red_marking in container.get_effective_markings(indicator))
+
     def test_marking_duplication(self):
         """Test that embedded STIX components are marked according to their parent TLO and global markings"""
         container = stixmarx.new()
@@ -313,6 +506,54 @@ class MarkingTest(unittest.TestCase):
                 self.assertTrue(('AMBER' in colors) == global_path_dict["should_pass"])
                 self.assertTrue(('RED' in colors) == local_path_dict["should_pass"])
 
+    def test_lazy_parse(self):
+        """Test that lazily parsed markings are attached on first query"""
+        xml = STIX_XML_TEMPLATE_GLOBAL_AND_COMPONENT.format(
+            "//node() | //@*",
+            "../../../descendant-or-self::node() | ../../../descendant-or-self::node()/@*"
+        )
+        container = stixmarx.parse(StringIO(xml), lazy=True)
+        indicator = container.package.indicators[0]
+
+        self.assertFalse(hasattr(indicator, "__datamarkings__"))
+
+        colors = sorted(marking_spec.marking_structures[0].color for marking_spec in container.get_markings(indicator))
+
+        self.assertEqual(colors, ["AMBER", "RED"])
+        self.assertTrue(hasattr(indicator.title, "__datamarkings__"))
+
+    def test_lazy_parse_field_value(self):
+        """Test that a lazily parsed field value can be queried directly"""
+        xml = STIX_XML_TEMPLATE_GLOBAL_AND_COMPONENT.format(
+            "//node() | //@*",
+            "../../../descendant-or-self::node() | ../../../descendant-or-self::node()/@*"
+        )
+        container = stixmarx.parse(StringIO(xml), lazy=True)
+        title = container.package.indicators[0].title
+
+        colors = sorted(marking_spec.marking_structures[0].color for marking_spec in container.get_markings(title))
+
+        self.assertEqual(colors, ["AMBER", "RED"])
+        self.assertTrue(container.is_marked(title))
+        self.assertTrue(hasattr(container.package.indicators[0].title, "__datamarkings__"))
+
+    def test_pickled_container(self):
+        """Test that markings survive pickling a parsed container"""
+        from stixmarx import bulk
+
+        xml = STIX_XML_TEMPLATE_GLOBAL_AND_COMPONENT.format(
+            "//node() | //@*",
+            "../../../descendant-or-self::node() | ../../../descendant-or-self::node()/@*"
+        )
+        container = bulk.loads(bulk.dumps(stixmarx.parse(StringIO(xml))))
+        indicator = container.package.indicators[0]
+
+        colors = sorted(marking_spec.marking_structures[0].color for marking_spec in container.get_markings(indicator))
+
+        self.assertEqual(colors, ["AMBER", "RED"])
+        self.assertEqual(indicator.title, "Test")
+        self.assertEqual(len(container.get_markings(indicator.title)), 2)
+
     def test_marking_path_parsing_for_observable(self):
         """Test that parsed paths are applied correctly to Observable"""
         
@@ -498,6 +739,57 @@ class MarkingTest(unittest.TestCase):
             red_marking
         )
 
+    def test_duplicate_check_global(self):
+        container = stixmarx.new()
+        package = container.package
+        indicator = Indicator(title="Test")
+        package.add(indicator)
+
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        container.add_global(red_marking)
+
+        self.assertRaises(
+            errors.DuplicateMarkingError,
+            container.add_global,
+            red_marking
+        )
+        self.assertRaises(
+            errors.DuplicateMarkingError,
+            container.add_marking,
+            indicator,
+            red_marking
+        )
+
+        container.remove_global(red_marking)
+        container.add_marking(indicator, red_marking)
+
+        self.assertTrue(container.is_marked(indicator, red_marking))
+
+    def test_equivalent_markings(self):
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        red_copy = generate_marking_spec(generate_red_marking_struct())
+        amber_marking = generate_marking_spec(generate_amber_marking_struct())
+        red_copy.controlled_structure = "//node() | //@*"
+
+        self.assertEqual(utils.spec_fingerprint(red_marking),
+                         utils.spec_fingerprint(red_copy))
+        self.assertTrue(utils.contains_spec([amber_marking, red_copy], red_marking))
+        self.assertFalse(utils.contains_spec([amber_marking], red_marking))
+        self.assertTrue(utils.contains_struct(red_copy, generate_red_marking_struct()))
+
+        fingerprints = utils.spec_fingerprints([amber_marking, red_copy])
+        self.assertTrue(utils.contains_spec([amber_marking, red_copy], red_marking, fingerprints))
+
+    def test_fingerprint_after_change(self):
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        red_copy = generate_marking_spec(generate_red_marking_struct())
+
+        self.assertTrue(utils.contains_spec([red_copy], red_marking))
+        self.assertTrue(utils.spec_fingerprint(red_copy) is utils.spec_fingerprint(red_copy))
+
+        red_copy.marking_structures[0].color = "AMBER"
+        self.assertFalse(utils.contains_spec([red_copy], red_marking))
+
     def test_is_marked(self):
         container = stixmarx.new()
         package = container.package
@@ -1,14 +1,23 @@
 # Copyright (c) 2015, The MITRE Corporation. All rights reserved.
 # See LICENSE.txt for complete terms.
 
+import os
+import shutil
+import tempfile
 import unittest
 
-from mixbox.vendor.six import StringIO
+from mixbox.vendor.six import BytesIO, StringIO
 import stix
 from stix import data_marking
 
+import stixmarx
 from stixmarx import api
+from stixmarx import bulk
+from stixmarx import classifier
+from stixmarx import errors
+from stixmarx import markingmap
 from stixmarx import parser
+from stixmarx import xml
 from stixmarx.api import types
 
 # All of the examples in this file should be valid STIX 1.1.1 and STIX 1.2,
@@ -83,6 +92,86 @@ XML_FIELDS = """
 </stix:STIX_Package>
 """.format(stix_version)
 
+XML_NESTED_FIELDS = """
+<stix:STIX_Package
+    xmlns:cybox="http://cybox.mitre.org/cybox-2"
+    xmlns:marking="http://data-marking.mitre.org/Marking-1"
+    xmlns:tlpMarking="http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1"
+    xmlns:indicator="http://stix.mitre.org/Indicator-2"
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    id="example:Package-88139233-3c7d-4913-bb5e-d2aeb079d029" version="{0}" timestamp="2015-02-26T21:00:37.453000+00:00">
+    <stix:STIX_Header>
+        <stix:Handling>
+            <marking:Marking>
+                <marking:Controlled_Structure>//stix:Indicator[@id='example:indicator1']/@id</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='RED'/>
+            </marking:Marking>
+            <marking:Marking>
+                <marking:Controlled_Structure>//indicator:Observable[@id='example:observable1']/@id</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='AMBER'/>
+            </marking:Marking>
+            <marking:Marking>
+                <marking:Controlled_Structure>//stix:Indicator[@id='example:indicator1']/indicator:Title/descendant-or-self::node()</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='GREEN'/>
+            </marking:Marking>
+            <marking:Marking>
+                <marking:Controlled_Structure>//indicator:Observable[@id='example:observable2']/cybox:Title/descendant-or-self::node()</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='WHITE'/>
+            </marking:Marking>
+        </stix:Handling>
+    </stix:STIX_Header>
+    <stix:Indicators>
+        <stix:Indicator id="example:indicator1" timestamp="2015-02-26T21:00:37.454000+00:00" xsi:type='indicator:IndicatorType'>
+            <indicator:Title>Indicator 1</indicator:Title>
+            <indicator:Observable id="example:observable1">
+                <cybox:Title>Observable 1</cybox:Title>
+            </indicator:Observable>
+        </stix:Indicator>
+        <stix:Indicator id="example:indicator2" timestamp="2015-02-26T21:00:37.454000+00:00" xsi:type='indicator:IndicatorType'>
+            <indicator:Title>Indicator 2</indicator:Title>
+            <indicator:Observable id="example:observable2">
+                <cybox:Title>Observable 2</cybox:Title>
+            </indicator:Observable>
+        </stix:Indicator>
+    </stix:Indicators>
+</stix:STIX_Package>
+""".format(stix_version)
+
+XML_OBSERVABLES = """
+<stix:STIX_Package
+    xmlns:cybox="http://cybox.mitre.org/cybox-2"
+    xmlns:marking="http://data-marking.mitre.org/Marking-1"
+    xmlns:tlpMarking="http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1"
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    id="example:Package-88139233-3c7d-4913-bb5e-d2aeb079d029" version="{0}" timestamp="2015-02-26T21:00:37.453000+00:00">
+    <stix:STIX_Header>
+        <stix:Handling>
+            <marking:Marking>
+                <marking:Controlled_Structure>../../../../stix:Observables[1]/cybox:Observable[1]/descendant-or-self::node()</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='RED'/>
+            </marking:Marking>
+            <marking:Marking>
+                <marking:Controlled_Structure>../../../../stix:Observables[1]/cybox:Observable[2]/descendant-or-self::node()</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='AMBER'/>
+            </marking:Marking>
+        </stix:Handling>
+    </stix:STIX_Header>
+    <stix:Observables cybox_major_version="2" cybox_minor_version="1">
+        <cybox:Observable id="example:observable1">
+            <cybox:Title>Observable 1</cybox:Title>
+        </cybox:Observable>
+        <cybox:Observable id="example:observable2">
+            <cybox:Title>Observable 2</cybox:Title>
+        </cybox:Observable>
+        <cybox:Observable id="example:observable3">
+            <cybox:Title>Observable 3</cybox:Title>
+        </cybox:Observable>
+    </stix:Observables>
+</stix:STIX_Package>
+""".format(stix_version)
+
 XML_LIST = """
 <stix:STIX_Package
     xmlns:marking="http://data-marking.mitre.org/Marking-1"
@@ -108,6 +197,36 @@ XML_LIST = """
 </stix:STIX_Package>
 """.format(stix_version)
 
+XML_LIST_POSITIONAL = """
+<stix:STIX_Package
+    xmlns:marking="http://data-marking.mitre.org/Marking-1"
+    xmlns:tlpMarking="http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1"
+    xmlns:indicator="http://stix.mitre.org/Indicator-2"
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    id="example:Package-88139233-3c7d-4913-bb5e-d2aeb079d029" version="{0}" timestamp="2015-02-26T21:00:37.453000+00:00">
+    <stix:STIX_Header>
+        <stix:Handling>
+            <marking:Marking>
+                <marking:Controlled_Structure>//stix:Indicator[@id='example:indicator1']/indicator:Alternative_ID[2]</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='RED'/>
+            </marking:Marking>
+            <marking:Marking>
+                <marking:Controlled_Structure>//stix:Indicator[@id='example:indicator1']/indicator:Alternative_ID[3]</marking:Controlled_Structure>
+                <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='AMBER'/>
+            </marking:Marking>
+        </stix:Handling>
+    </stix:STIX_Header>
+    <stix:Indicators>
+        <stix:Indicator id="example:indicator1" timestamp="2015-02-26T21:00:37.454000+00:00" xsi:type='indicator:IndicatorType'>
+            <indicator:Alternative_ID>foo</indicator:Alternative_ID>
+            <indicator:Alternative_ID>bar</indicator:Alternative_ID>
+            <indicator:Alternative_ID>baz</indicator:Alternative_ID>
+        </stix:Indicator>
+    </stix:Indicators>
+</stix:STIX_Package>
+""".format(stix_version)
+
 ISSUE9_XML = """
 <stix:STIX_Package
     xmlns:FileObj="http://cybox.mitre.org/objects#FileObject-2"
@@ -200,6 +319,77 @@ MULTIVALUE_INSTANCE_XML = """
 </stix:STIX_Package>
 """.format(stix_version)
 
+XML_RELATIVE = """
+<stix:STIX_Package
+    xmlns:marking="http://data-marking.mitre.org/Marking-1"
+    xmlns:tlpMarking="http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1"
+    xmlns:indicator="http://stix.mitre.org/Indicator-2"
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    id="example:Package-88139233-3c7d-4913-bb5e-d2aeb079d029" version="{0}" timestamp="2015-02-26T21:00:37.453000+00:00">
+    <stix:Indicators>
+        <stix:Indicator id="example:indicator1" timestamp="2015-02-26T21:00:37.454000+00:00" xsi:type='indicator:IndicatorType'>
+            <indicator:Title>Indicator 1</indicator:Title>
+            <indicator:Alternative_ID>foo</indicator:Alternative_ID>
+            <indicator:Alternative_ID>bar</indicator:Alternative_ID>
+            <indicator:Description>A Description for Indicator 1</indicator:Description>
+            <indicator:Handling>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../indicator:Title[1]/self::node()</marking:Controlled_Structure>
+                    <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='RED'/>
+                </marking:Marking>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../indicator:Alternative_ID[2]/text() | ../../../@id</marking:Controlled_Structure>
+                    <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='AMBER'/>
+                </marking:Marking>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../indicator:Description/descendant-or-self::node() | ../../../@*</marking:Controlled_Structure>
+                    <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='GREEN'/>
+                </marking:Marking>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../descendant-or-self::node()/@*</marking:Controlled_Structure>
+                </marking:Marking>
+            </indicator:Handling>
+        </stix:Indicator>
+    </stix:Indicators>
+</stix:STIX_Package>
+""".format(stix_version)
+
+XML_REPEATED = """
+<stix:STIX_Package
+    xmlns:marking="http://data-marking.mitre.org/Marking-1"
+    xmlns:tlpMarking="http://data-marking.mitre.org/extensions/MarkingStructure#TLP-1"
+    xmlns:indicator="http://stix.mitre.org/Indicator-2"
+    xmlns:stix="http://stix.mitre.org/stix-1"
+    xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    id="example:Package-88139233-3c7d-4913-bb5e-d2aeb079d029" version="{0}" timestamp="2015-02-26T21:00:37.453000+00:00">
+    <stix:Indicators>
+        <stix:Indicator id="example:indicator1" xsi:type='indicator:IndicatorType'>
+            <indicator:Title>Indicator 1</indicator:Title>
+            <indicator:Handling>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../descendant-or-self::node() | ../../../descendant-or-self::node()/@*</marking:Controlled_Structure>
+                    <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='AMBER'/>
+                </marking:Marking>
+            </indicator:Handling>
+        </stix:Indicator>
+        <stix:Indicator id="example:indicator2" xsi:type='indicator:IndicatorType'>
+            <indicator:Title>Indicator 2</indicator:Title>
+            <indicator:Handling>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../descendant-or-self::node() | ../../../descendant-or-self::node()/@*</marking:Controlled_Structure>
+                    <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='AMBER'/>
+                </marking:Marking>
+                <marking:Marking>
+                    <marking:Controlled_Structure>../../../descendant-or-self::node() | ../../../descendant-or-self::node()/@*</marking:Controlled_Structure>
+                    <marking:Marking_Structure xsi:type='tlpMarking:TLPMarkingStructureType' color='RED'/>
+                </marking:Marking>
+            </indicator:Handling>
+        </stix:Indicator>
+    </stix:Indicators>
+</stix:STIX_Package>
+""".format(stix_version)
+
 
 class MarkingParserTests(unittest.TestCase):
 
@@ -315,6 +505,306 @@ class FieldXMLTests(unittest.TestCase):
         self.assertEqual(len(ip_address.__datamarkings__), 1)
 
 
+class NestedFieldXMLTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        sio = StringIO(XML_NESTED_FIELDS)
+        cls.PACKAGE = parser.MarkingParser(sio).parse()
+
+    def colors(self, value):
+        markings = getattr(value, "__datamarkings__", ())
+        return [x.marking_structures[0].color for x in markings]
+
+    def test_field_names_under_several_parents(self):
+        first, second = self.PACKAGE.indicators
+
+        # @id and Title are fields of both the Indicators and the Observables.
+        self.assertEqual(self.colors(first.id_), ["RED"])
+        self.assertEqual(self.colors(first.title), ["GREEN"])
+        self.assertEqual(self.colors(first.observable.id_), ["AMBER"])
+        self.assertEqual(self.colors(first.observable.title), [])
+
+        self.assertEqual(self.colors(second.id_), [])
+        self.assertEqual(self.colors(second.title), [])
+        self.assertEqual(self.colors(second.observable.id_), [])
+        self.assertEqual(self.colors(second.observable.title), ["WHITE"])
+
+    def test_index_element_and_attribute_names(self):
+        document = (
+            "<a id='a1'><id>a2</id>"
+            "<b id='b1'><id>b2</id><id>b3</id></b>"
+            "<c><id>c1</id></c></a>"
+        )
+        root = xml.root(StringIO(document))
+        b, c = root.findall("b") + root.findall("c")
+        index = xml.index_fields(root)
+
+        def text(key):
+            return [x if xml.is_attribute(x) else x.text for x in index.get(key, [])]
+
+        # "id" is an attribute and a child element name under several parents.
+        self.assertEqual(text((root, "@id")), ["a1"])
+        self.assertEqual(text((root, "id")), ["a2"])
+        self.assertEqual(text((b, "@id")), ["b1"])
+        self.assertEqual(text((b, "id")), ["b2", "b3"])
+        self.assertEqual(text((c, "@id")), [])
+        self.assertEqual(text((c, "id")), ["c1"])
+
+
+class MarkingMapTests(unittest.TestCase):
+    def test_global_markings_not_expanded(self):
+        root = xml.root(StringIO(XML_GLOBAL))
+        marked = markingmap.build(root)
+
+        self.assertEqual(len(marked), 0)
+
+        title = next(root.iter("{*}Title"))
+        self.assertTrue(title in marked)
+        self.assertEqual(len(marked[title]), 1)
+
+        attr = root.xpath("//@id")[0]
+        self.assertTrue(attr in marked)
+        self.assertEqual(marked[attr], marked[title])
+
+    def test_field_nodes(self):
+        root = xml.root(StringIO(XML_FIELDS))
+        marked = markingmap.build(root)
+        namespaces = {
+            "stix": "http://stix.mitre.org/stix-1",
+            "indicator": "http://stix.mitre.org/Indicator-2"
+        }
+
+        first, second = root.xpath("//stix:Indicator/@id", namespaces=namespaces)
+        self.assertTrue(first in marked)
+        self.assertFalse(second in marked)
+
+        first, second = root.xpath("//indicator:Title", namespaces=namespaces)
+        self.assertTrue(first in marked)
+        self.assertTrue(first.xpath("text()")[0] in marked)
+        self.assertFalse(second in marked)
+        self.assertFalse(second.xpath("text()")[0] in marked)
+        self.assertFalse(None in marked)
+
+    def test_subtree_markings_not_expanded(self):
+        root = xml.root(StringIO(XML_FIELDS))
+        marked = markingmap.build(root)
+
+        # Only the @id and @timestamp attribute markings are stored per node.
+        self.assertEqual(len(marked), 2)
+
+        title, description = next(root.iter("{*}Indicator"))
+        self.assertEqual(len(marked[title]), 1)
+        self.assertEqual(len(marked[description]), 1)
+        self.assertNotEqual(marked[title], marked[description])
+        self.assertEqual(marked[title], marked[title.xpath("text()")[0]])
+
+    def test_classified_shapes(self):
+        root = xml.root(StringIO(XML_RELATIVE))
+        marked = markingmap.build(root)
+
+        self.assertEqual(marked.stats[classifier.SHAPE_NODE], 1)
+        self.assertEqual(marked.stats[classifier.SHAPE_FIELD], 1)
+        self.assertEqual(marked.stats[classifier.SHAPE_SUBTREE], 2)
+        self.assertEqual(marked.stats[classifier.SHAPE_XPATH], 0)
+
+    def test_classified_matches_xpath(self):
+        root = xml.root(StringIO(XML_RELATIVE))
+        marked = markingmap.build(root)
+        nodes = root.xpath("//node() | //@*")
+
+        for spec in root.iter("{*}Marking"):
+            control = spec[0]
+            selected = control.xpath(control.text, namespaces={
+                "indicator": "http://stix.mitre.org/Indicator-2"
+            })
+
+            for node in selected:
+                self.assertTrue(spec in marked[node])
+
+            found = [x for x in nodes if spec in marked.get(x, ())]
+            self.assertEqual(len(found), len(selected))
+
+    def test_classify_unknown(self):
+        self.assertEqual(classifier.classify("//stix:Indicator[@id='x']/@id"), None)
+        self.assertEqual(classifier.classify("../../following-sibling::*"), None)
+
+
+class InterningTests(unittest.TestCase):
+    def _amber(self, indicator):
+        specs = indicator.title.__datamarkings__
+        return [x for x in specs if x.marking_structures[0].color == "AMBER"]
+
+    def test_no_interning(self):
+        package = parser.parse_xml(StringIO(XML_REPEATED))
+        first, second = package.indicators
+
+        self.assertFalse(self._amber(first)[0] is self._amber(second)[0])
+
+    def test_document_interning(self):
+        package = parser.parse_xml(StringIO(XML_REPEATED), interning="document")
+        first, second = package.indicators
+        amber = self._amber(first)[0]
+
+        self.assertTrue(amber is self._amber(second)[0])
+        self.assertTrue(second.handling.marking[0] is amber)
+        self.assertEqual(len(second.title.__datamarkings__), 2)
+
+    def test_process_interning(self):
+        first = parser.parse_xml(StringIO(XML_REPEATED), interning="process")
+        second = parser.parse_xml(StringIO(XML_REPEATED), interning="process")
+
+        amber = self._amber(first.indicators[0])[0]
+        self.assertTrue(amber is self._amber(second.indicators[1])[0])
+
+    def test_invalid_mode(self):
+        self.assertRaises(
+            errors.InvalidModeError,
+            parser.MarkingParser,
+            StringIO(XML_REPEATED),
+            interning="thread"
+        )
+
+
+class XPathCacheTests(unittest.TestCase):
+    def test_compiled_once(self):
+        xml.clear_xpath_cache()
+        parser.parse_xml(StringIO(XML_FIELDS))
+        first = xml.xpath_cache_info()
+
+        parser.parse_xml(StringIO(XML_FIELDS))
+        second = xml.xpath_cache_info()
+
+        self.assertTrue(first.misses > 0)
+        self.assertEqual(second.misses, first.misses)
+        self.assertTrue(second.hits > first.hits)
+
+
+class SignalSessionTests(unittest.TestCase):
+    def test_idle_parser_receives_no_entities(self):
+        idle = parser.MarkingParser(StringIO(XML_FIELDS))
+        parser.MarkingParser(StringIO(XML_GLOBAL)).parse()
+
+        self.assertEqual(len(idle._entities), 0)
+
+    def test_session_closed_after_parse(self):
+        parser.MarkingParser(StringIO(XML_FIELDS)).parse()
+        self.assertFalse(parser._active_sessions())
+
+
+class StreamingTests(unittest.TestCase):
+    def test_iterparse_field_markings(self):
+        sio = BytesIO(XML_FIELDS.encode("utf-8"))
+        first, second = list(parser.iterparse_xml(sio))
+
+        self.assertEqual(len(first.id_.__datamarkings__), 1)
+        self.assertEqual(len(first.title.__datamarkings__), 1)
+
+        spec = next(iter(first.title.__datamarkings__))
+        self.assertEqual(spec.marking_structures[0].color, "AMBER")
+
+        self.assertFalse(hasattr(second, "__datamarkings__"))
+        self.assertFalse(hasattr(second.title, "__datamarkings__"))
+
+    def test_iterparse_header_markings(self):
+        sio = BytesIO(XML_GLOBAL.encode("utf-8"))
+        indicators = list(parser.iterparse_xml(sio))
+
+        self.assertEqual(len(indicators), 1)
+
+        for obj in (indicators[0], indicators[0].title):
+            spec = next(iter(obj.__datamarkings__))
+            self.assertEqual(spec.marking_structures[0].color, "GREEN")
+
+    def test_iterparse_positional_header_markings(self):
+        sio = BytesIO(XML_OBSERVABLES.encode("utf-8"))
+        observables = list(parser.iterparse_xml(sio))
+
+        self.assertEqual(len(observables), 3)
+
+        for observable, color in zip(observables, ("RED", "AMBER")):
+            for obj in (observable, observable.title):
+                colors = [x.marking_structures[0].color for x in obj.__datamarkings__]
+                self.assertEqual(colors, [color])
+
+        self.assertFalse(hasattr(observables[2], "__datamarkings__"))
+        self.assertFalse(hasattr(observables[2].title, "__datamarkings__"))
+
+    def test_iterparse_positional_union(self):
+        path = "cybox:Observable[1]/descendant-or-self::node()"
+        union = path + " | ../../../../stix:Observables[1]/*[3]/descendant-or-self::node()"
+        document = XML_OBSERVABLES.replace(path, union)
+        sio = BytesIO(document.encode("utf-8"))
+        observables = list(parser.iterparse_xml(sio))
+
+        for observable, color in zip(observables, ("RED", "AMBER", "RED")):
+            for obj in (observable, observable.title):
+                colors = [x.marking_structures[0].color for x in obj.__datamarkings__]
+                self.assertEqual(colors, [color])
+
+    def test_iterparse_sibling_path(self):
+        document = XML_OBSERVABLES.replace("cybox:Observable[2]", "cybox:Observable[last()]")
+        sio = BytesIO(document.encode("utf-8"))
+
+        self.assertRaises(
+            errors.UnrecognizedMarkingPathError,
+            list,
+            parser.iterparse_xml(sio)
+        )
+
+
+def _title_colors(container):
+    """parse_many() reducer which returns the marking colors of the first
+    Indicator title of `container`.
+    """
+    title = container.package.indicators[0].title
+    return sorted(x.marking_structures[0].color for x in container.get_markings(title))
+
+
+class BulkTests(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.DIRECTORY = tempfile.mkdtemp()
+        cls.PATHS = []
+
+        for name, document in (("global.xml", XML_GLOBAL), ("fields.xml", XML_FIELDS)):
+            path = os.path.join(cls.DIRECTORY, name)
+
+            with open(path, "wb") as f:
+                f.write(document.encode("utf-8"))
+
+            cls.PATHS.append(path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.DIRECTORY)
+
+    def test_parse_many(self):
+        containers = list(bulk.parse_many(self.PATHS, workers=2))
+
+        self.assertEqual(len(containers), 2)
+        self.assertEqual([_title_colors(x) for x in containers], [["GREEN"], ["AMBER"]])
+
+        indicator = containers[1].package.indicators[0]
+        self.assertEqual(indicator.title, "Indicator 1")
+        self.assertEqual(len(indicator.id_.__datamarkings__), 1)
+        self.assertFalse(hasattr(containers[1].package.indicators[1].title, "__datamarkings__"))
+
+    def test_parse_many_unordered(self):
+        results = bulk.parse_many(self.PATHS * 2, workers=2, ordered=False,
+                                  reducer=_title_colors, chunksize=2)
+
+        self.assertEqual(sorted(results), [["AMBER"], ["AMBER"], ["GREEN"], ["GREEN"]])
+
+    def test_pickle_round_trip(self):
+        container = bulk.loads(bulk.dumps(stixmarx.parse(self.PATHS[1])))
+        indicator = container.package.indicators[0]
+
+        # The field values are keyed by the TypedFields of this process.
+        self.assertEqual(indicator.title, "Indicator 1")
+        self.assertEqual(_title_colors(container), ["AMBER"])
+        self.assertTrue(container.to_xml())
+
+
 class ListXMLTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
@@ -337,6 +827,23 @@ class ListXMLTests(unittest.TestCase):
         self.assertEqual(fspec.marking_structures[0].color, "GREEN")
         self.assertEqual(bspec.marking_structures[0].color, "GREEN")
 
+    def test_alternate_id_list_positional(self):
+        sio = StringIO(XML_LIST_POSITIONAL)
+        package = parser.MarkingParser(sio).parse()
+
+        i = package.indicators[0]
+        foo, bar, baz = i.alternative_id
+
+        self.assertFalse(hasattr(foo, "__datamarkings__"))
+        self.assertEqual(len(bar.__datamarkings__), 1)
+        self.assertEqual(len(baz.__datamarkings__), 1)
+
+        bspec = next(iter(bar.__datamarkings__))
+        zspec = next(iter(baz.__datamarkings__))
+
+        self.assertEqual(bspec.marking_structures[0].color, "RED")
+        self.assertEqual(zspec.marking_structures[0].color, "AMBER")
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -5,9 +5,10 @@ from __future__ import print_function
 
 # stdlib
 import unittest
-from mixbox.vendor.six import StringIO
+from mixbox.vendor.six import BytesIO, StringIO
 
 # external
+from lxml import etree
 from cybox.core import Observable
 from cybox.objects.address_object import Address
 from stix.common.kill_chains import KillChain, KillChainPhase
@@ -16,6 +17,7 @@ from stix.data_marking import MarkingSpecification
 from stix.extensions.marking.tlp import TLPMarkingStructure as TLP
 from stix.incident import Incident
 from stix.indicator import Indicator
+from stix.ttp import TTP
 
 # internal
 import stixmarx
@@ -23,6 +25,7 @@ from stixmarx import api
 from stixmarx import errors
 from stixmarx import navigator
 from stixmarx import xml
+from stixmarx.api import types
 
 
 class SerializeTest(unittest.TestCase):
@@ -282,6 +285,204 @@ class SerializeTest(unittest.TestCase):
         # There should be only one object with markings in the whole package.
         self.assertTrue(counter == 1)
 
+    def test_equal_list_values(self):
+        """Test that equal values in a list field are told apart by
+            position."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        indicator = Indicator(title="Test")
+        indicator.alternative_id.append(types.MarkableText(u"example:alt"))
+        indicator.alternative_id.append(types.MarkableText(u"example:alt"))
+        package.add_indicator(indicator)
+
+        container.add_marking(indicator.alternative_id[1], red_marking)
+        container.flush()
+
+        self.assertEqual(
+            indicator.handling.marking[0].controlled_structure,
+            "../../../indicator:Alternative_ID[2]/self::node()"
+        )
+
+    def test_field_paths(self):
+        """Test the exact controlled structures of nested, list-valued and
+            attribute field markings."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        indicator = Indicator(title="Test")
+        indicator.alternative_id.append("example:alt-1")
+        indicator.alternative_id.append("example:alt-2")
+        observable = generate_observable()
+        indicator.add_observable(observable)
+        package.add_indicator(indicator)
+
+        indicator.title = container.add_marking(indicator.title, red_marking)
+        indicator.id_ = container.add_marking(indicator.id_, red_marking)
+        indicator.alternative_id[1] = container.add_marking(
+            indicator.alternative_id[1],
+            red_marking
+        )
+        address = observable.object_.properties.address_value
+        address.value = container.add_marking(address.value, red_marking)
+
+        container.flush()
+
+        structures = sorted(
+            x.controlled_structure for x in indicator.handling.marking
+        )
+
+        self.assertEqual(structures, [
+            "../../../@id",
+            "../../../indicator:Alternative_ID[2]/self::node()",
+            "../../../indicator:Observable[1]/cybox:Object[1]/"
+            "cybox:Properties[1]/AddressObj:Address_Value[1]/text()",
+            "../../../indicator:Title[1]/self::node()",
+        ])
+
+    def test_marking_clones(self):
+        """Test that applied markings share the source marking structures."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        indicator = Indicator(title="Test")
+        package.add_indicator(indicator)
+        container.add_marking(indicator, red_marking)
+        container.flush()
+
+        applied = package.indicators[0].handling.marking[0]
+
+        self.assertTrue(applied is not red_marking)
+        self.assertTrue(applied.controlled_structure is not None)
+        self.assertTrue(red_marking.controlled_structure is None)
+        self.assertTrue(applied.marking_structures is red_marking.marking_structures)
+
+    def test_coalesced_markings(self):
+        """Test that coalesced field markings share one Marking per
+            Handling."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        indicator = Indicator(title="Test")
+        indicator.description = "Test description"
+        package.add_indicator(indicator)
+
+        indicator.title = container.add_marking(indicator.title, red_marking)
+        indicator.description.value = \
+            container.add_marking(indicator.description.value, red_marking)
+
+        container.flush(coalesce=True)
+
+        markings = package.indicators[0].handling.marking
+        self.assertEqual(len(markings), 1)
+        self.assertEqual(len(markings[0].controlled_structure.split(" | ")), 2)
+
+    def test_coalesced_markings_max_length(self):
+        """Test that coalesced XPaths are split at max_xpath_length."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        indicator = Indicator(title="Test")
+        indicator.description = "Test description"
+        package.add_indicator(indicator)
+
+        indicator.title = container.add_marking(indicator.title, red_marking)
+        indicator.description.value = \
+            container.add_marking(indicator.description.value, red_marking)
+
+        container.flush(coalesce=True, max_xpath_length=1)
+
+        markings = package.indicators[0].handling.marking
+        self.assertEqual(len(markings), 2)
+
+    def test_cached_output(self):
+        """Test that cached output is reused until markings change."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        amber_marking = generate_marking_spec(generate_amber_marking_struct())
+
+        indicator = Indicator(title="Test")
+        package.add_indicator(indicator)
+        container.add_marking(indicator, red_marking)
+
+        xml_out = container.to_xml(use_cache=True)
+        self.assertTrue(container.to_xml(use_cache=True) is xml_out)
+
+        dict_out = container.to_dict(use_cache=True)
+        self.assertEqual(container.to_dict(use_cache=True), dict_out)
+
+        container.add_global(amber_marking)
+        self.assertFalse(container.to_xml(use_cache=True) is xml_out)
+
+    def test_write_xml(self):
+        """Test that a package written one TLO at a time keeps its markings."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+        amber_marking = generate_marking_spec(generate_amber_marking_struct())
+
+        first = Indicator(title="First")
+        second = Indicator(title="Second")
+        package.add_indicator(first)
+        package.add_indicator(second)
+        package.add_observable(generate_observable())
+
+        container.add_marking(second, red_marking, descendants=True)
+        container.add_global(amber_marking)
+
+        out = BytesIO()
+        container.write_xml(out)
+        out.seek(0)
+
+        parsed = stixmarx.parse(out)
+        parsed_package = parsed.package
+
+        self.assertEqual(len(parsed_package.indicators), 2)
+        self.assertEqual(len(parsed_package.observables), 1)
+
+        parsed_first = parsed_package.indicators[0]
+        parsed_second = parsed_package.indicators[1]
+
+        self.assertEqual(len(parsed.get_markings(parsed_first)), 1)
+        self.assertEqual(len(parsed.get_markings(parsed_second)), 2)
+        self.assertEqual(len(parsed.get_markings(parsed_second.title)), 2)
+
+    def test_write_xml_collection_fields(self):
+        """Test that write_xml() keeps the TLO collection fields which are
+        not top-level objects."""
+        container = stixmarx.new()
+        package = container.package
+        red_marking = generate_marking_spec(generate_red_marking_struct())
+
+        kill_chain = KillChain(id_="example:kc-1234", name="Test Kill Chain")
+        kill_chain.add_kill_chain_phase(
+            KillChainPhase(phase_id="example:kcp-1234", name="Test Kill Chain Phase")
+        )
+
+        package.ttps = ttps.TTPs()
+        package.ttps.kill_chains.kill_chain.append(kill_chain)
+        package.add_ttp(TTP(title="First"))
+        package.add_ttp(TTP(title="Second"))
+
+        container.add_marking(package.ttps[1], red_marking, descendants=True)
+
+        out = BytesIO()
+        container.write_xml(out)
+
+        def canonical(document):
+            parser = etree.XMLParser(remove_blank_text=True)
+            root = etree.fromstring(document, parser)
+            return etree.tostring(root, method="c14n", exclusive=True)
+
+        self.assertEqual(canonical(out.getvalue()),
+                         canonical(container.to_xml()))
+
     def test_null_marking_serialization(self):
         """Test that a null marking gets serialized."""
         container = stixmarx.new()
@@ -317,7 +317,117 @@ def is_reference(item):
         return False
 
 
-def contains_struct(spec, struct):
+# Caches the fingerprint of a marking object on the object itself.
+_ATTR_FINGERPRINT = "__fingerprint__"
+
+
+def _freeze(value):
+    """Return a hashable equivalent of the to_dict() output `value`."""
+    if isinstance(value, dict):
+        return frozenset((k, _freeze(v)) for k, v in iteritems(value))
+
+    if isinstance(value, list):
+        return tuple(_freeze(x) for x in value)
+
+    return value
+
+
+def _stamp(value):
+    """Return a snapshot of the field values of the entity `value` and of
+    the entities and lists it holds. It compares unequal to an earlier
+    snapshot once any of those fields has been set to another value.
+    """
+    fields_ = getattr(value, "_fields", None)
+
+    if isinstance(fields_, dict):
+        # Keyed by XML name, so the snapshot holds no TypedField.
+        return tuple((k.name, _stamp(v)) for k, v in iteritems(fields_))
+
+    if isinstance(value, dict):
+        return tuple((k, _stamp(v)) for k, v in iteritems(value))
+
+    if is_sequence(value):
+        return tuple(_stamp(x) for x in value)
+
+    return value
+
+
+def _fingerprint(entity, exclude=None):
+    """Return the fingerprint of `entity`, computed from
+    ``entity.to_dict()`` without the `exclude` key.
+
+    The fingerprint is cached on `entity` and computed again only when a
+    field of `entity`, or of an entity it holds, has changed since.
+    """
+    stamp = _stamp(entity)
+    cached = getattr(entity, _ATTR_FINGERPRINT, None)
+
+    if cached is not None and cached[0] == exclude and cached[1] == stamp:
+        return cached[2]
+
+    entity_dict = entity.to_dict()
+
+    if exclude:
+        entity_dict.pop(exclude, None)
+
+    fingerprint = _freeze(entity_dict)
+    setattr(entity, _ATTR_FINGERPRINT, (exclude, stamp, fingerprint))
+
+    return fingerprint
+
+
+def struct_fingerprint(struct):
+    """Return a hashable fingerprint of the MarkingStructure `struct`.
+    Equivalent marking structures have equal fingerprints.
+
+    Note:
+        The fingerprint is cached on `struct` and computed again once
+        `struct` is changed.
+    """
+    return _fingerprint(struct)
+
+
+def spec_fingerprint(spec):
+    """Return a hashable fingerprint of the MarkingSpecification `spec`.
+    Specifications which are equivalent apart from their
+    controlled_structure have equal fingerprints.
+
+    Note:
+        The fingerprint is cached on `spec` and computed again once `spec`
+        is changed.
+    """
+    return _fingerprint(spec, exclude="controlled_structure")
+
+
+def struct_fingerprints(structs):
+    """Return a frozenset of the struct_fingerprint() of each
+    MarkingStructure in `structs`.
+    """
+    return frozenset(struct_fingerprint(x) for x in structs)
+
+
+def spec_fingerprints(specs):
+    """Return a frozenset of the spec_fingerprint() of each
+    MarkingSpecification in `specs`.
+
+    The set can be computed once and passed to contains_spec() to check
+    many specifications against the same list with one lookup each.
+    Compute it again after any of `specs` is changed.
+    """
+    return frozenset(spec_fingerprint(x) for x in specs)
+
+
+def contains_struct(spec, struct, fingerprints=None):
+    """Return True if `spec` has `struct`, or an equivalent marking
+    structure, in its marking_structures.
+
+    Args:
+        spec: A MarkingSpecification object.
+        struct: A MarkingStructure object.
+        fingerprints: The struct_fingerprints() of the marking structures
+            of `spec`. If not given, the marking structures are compared
+            one at a time until an equivalent one is found.
+    """
     structs = spec.marking_structures
 
     if not structs:
@@ -326,28 +436,37 @@ def contains_struct(spec, struct):
     if struct in structs:
         return True
 
-    # Try to see if an equivalent struct is in the marking_spec
-    struct_dict = struct.to_dict()
-    return any(struct_dict == s.to_dict() for s in structs.to_list())
+    fingerprint = struct_fingerprint(struct)
 
+    if fingerprints is not None:
+        return fingerprint in fingerprints
 
-def contains_spec(specs, spec):
-    def strip_cs(d):
-        """Remove the 'controlled_structure' entry from the dictionary
-        if it is present.
+    return any(fingerprint == struct_fingerprint(x) for x in structs.to_list())
 
-        """
-        d.pop('controlled_structure', None)
-        return d
 
+def contains_spec(specs, spec, fingerprints=None):
+    """Return True if `spec`, or a specification equivalent to it apart
+    from its controlled_structure, is in `specs`.
+
+    Args:
+        specs: A list of MarkingSpecification objects.
+        spec: A MarkingSpecification object.
+        fingerprints: The spec_fingerprints() of `specs`. If not given,
+            `specs` are compared one at a time until an equivalent one is
+            found.
+    """
     if not specs:
         return False
 
     if spec in specs:
         return True
 
-    spec_dict = strip_cs(spec.to_dict())
-    return any(spec_dict == strip_cs(s.to_dict()) for s in specs)
+    fingerprint = spec_fingerprint(spec)
+
+    if fingerprints is not None:
+        return fingerprint in fingerprints
+
+    return any(fingerprint == spec_fingerprint(x) for x in specs)
 
 
 def fields(entity):
@@ -1,7 +1,13 @@
 # Copyright (c) 2017, The MITRE Corporation. All rights reserved.
 # See LICENSE.txt for complete terms.
 
+# stdlib
+import collections
+import threading
+
+# external
 from lxml import etree
+from mixbox.vendor.six import iteritems
 
 # Namespaces
 NS_XSI = "http://www.w3.org/2001/XMLSchema-instance"
@@ -41,6 +47,85 @@ XPATH_WILDCARD_ALL_ATTRS = "@*"
 # Node selection structure
 XPATH_STRUCTURE = "{prefix}:{nodename}[{predicates}]"
 
+# Selects every attribute and text node in a document in document order.
+XPATH_ALL_ATTRS_AND_TEXT = "//@* | //text()"
+
+# Field selector for text content.
+SELECTOR_TEXT = "text()"
+
+# Maximum number of compiled XPath objects kept by compile_xpath().
+XPATH_CACHE_SIZE = 256
+
+# Compiled XPath objects keyed by (expression, namespaces), least recently
+# used first, and the lock and counters which go with them.
+_XPATH_CACHE = collections.OrderedDict()
+_XPATH_CACHE_LOCK = threading.Lock()
+_XPATH_CACHE_STATS = {"hits": 0, "misses": 0}
+
+XPathCacheInfo = collections.namedtuple(
+    "XPathCacheInfo",
+    ["hits", "misses", "maxsize", "currsize"]
+)
+
+
+def compile_xpath(expression, namespaces=None):
+    """Return a compiled ``etree.XPath`` object for `expression`.
+
+    Compiled objects are shared by every caller in the process. The
+    XPATH_CACHE_SIZE most recently used (expression, namespaces) pairs are
+    kept.
+
+    Args:
+        expression: An XPath expression string.
+        namespaces: A dictionary which maps prefixes to namespaces.
+
+    Returns:
+        An ``etree.XPath`` object.
+
+    Raises:
+        etree.XPathSyntaxError: If `expression` cannot be compiled.
+    """
+    key = (expression, frozenset(iteritems(namespaces or {})))
+
+    with _XPATH_CACHE_LOCK:
+        compiled = _XPATH_CACHE.pop(key, None)
+
+        if compiled is not None:
+            _XPATH_CACHE[key] = compiled
+            _XPATH_CACHE_STATS["hits"] += 1
+            return compiled
+
+        _XPATH_CACHE_STATS["misses"] += 1
+
+    compiled = etree.XPath(expression, namespaces=namespaces)
+
+    with _XPATH_CACHE_LOCK:
+        _XPATH_CACHE[key] = compiled
+
+        while len(_XPATH_CACHE) > XPATH_CACHE_SIZE:
+            _XPATH_CACHE.popitem(last=False)
+
+    return compiled
+
+
+def xpath_cache_info():
+    """Return an XPathCacheInfo tuple describing the compile_xpath() cache."""
+    with _XPATH_CACHE_LOCK:
+        return XPathCacheInfo(
+            _XPATH_CACHE_STATS["hits"],
+            _XPATH_CACHE_STATS["misses"],
+            XPATH_CACHE_SIZE,
+            len(_XPATH_CACHE)
+        )
+
+
+def clear_xpath_cache():
+    """Remove all compiled XPath objects and reset the cache counters."""
+    with _XPATH_CACHE_LOCK:
+        _XPATH_CACHE.clear()
+        _XPATH_CACHE_STATS["hits"] = 0
+        _XPATH_CACHE_STATS["misses"] = 0
+
 
 def is_element(node):
     """Return True if the input `node` is an XML element node."""
@@ -111,6 +196,38 @@ def to_etree(doc, encoding=None):
         return etree.parse(doc, parser=parser)
 
 
+def iterparse(doc, encoding=None):
+    """Return an lxml iterparse iterator which yields ``("start", node)``
+    and ``("end", node)`` events for each element in `doc`.
+
+    The underlying parser uses the same options as get_xml_parser().
+
+    Args:
+        doc: A filename or read()-able XML document.
+        encoding: The encoding of the input document.
+    """
+    return etree.iterparse(
+        doc,
+        events=("start", "end"),
+        huge_tree=True,
+        remove_comments=True,
+        strip_cdata=False,
+        remove_blank_text=True,
+        resolve_entities=False,
+        encoding=encoding
+    )
+
+
+def copy_element(node):
+    """Return a new element with the tag, attributes and in-scope namespaces
+    of `node`, but none of its children or text.
+
+    Args:
+        node: An lxml etree Element object.
+    """
+    return etree.Element(node.tag, attrib=dict(node.attrib), nsmap=node.nsmap)
+
+
 def root(doc, encoding=None):
     """Return the root node for the input XML `doc`.
 
@@ -212,3 +329,49 @@ def findtext(node):
         node: An lxml etree Element node.
     """
     return next(iter(node.xpath("text()")), None)
+
+
+def index_fields(root):
+    """Build an index of the field nodes found in the document under `root`
+    in a single pass.
+
+    The index maps ``(element, selector)`` tuples to a list of the nodes that
+    the selector resolves to under the element, in document order. Selectors
+    are the same as those returned by the attrmap module:
+
+    * An element localname (e.g., ``"Title"``) resolves to the child elements
+      with that localname, regardless of namespace.
+    * An ``"@"`` prefixed attribute name (e.g., ``"@id"``) resolves to the
+      unqualified attribute with that name.
+    * ``"text()"`` resolves to the text node children of the element.
+
+    Namespace-qualified attributes are not indexed.
+
+    Args:
+        root: An lxml etree Element object.
+
+    Returns:
+        A dictionary which maps ``(element, selector)`` tuples to lists of
+        lxml nodes.
+    """
+    index = collections.defaultdict(list)
+
+    for node in root.iter(etree.Element):
+        parent = node.getparent()
+
+        if parent is not None:
+            index[(parent, localname(node))].append(node)
+
+    for node in root.xpath(XPATH_ALL_ATTRS_AND_TEXT):
+        parent = node.getparent()
+
+        if is_attribute(node):
+            if not node.attrname.startswith("{"):
+                index[(parent, "@" + node.attrname)].append(node)
+        elif node.is_tail:
+            # Tail text belongs to the parent of the element it follows.
+            index[(parent.getparent(), SELECTOR_TEXT)].append(node)
+        else:
+            index[(parent, SELECTOR_TEXT)].append(node)
+
+    return dict(index)